@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -10,7 +10,100 @@ class Settings(BaseSettings):
     # Local Model Settings
     # Whisper model size - sử dụng tiny để tiết kiệm tài nguyên
     whisper_model_size: str = "base"  # Options: tiny, base, small, medium, large
-    
+    # "int8" = dynamic int8 quantization of the Linear layers (nhanh hơn trên CPU, xem scripts/benchmark_stt.py)
+    whisper_backend: str = "float"  # Options: float, int8
+    # Whisper replica pool - mỗi replica chỉ phục vụ một request tại một thời điểm
+    whisper_pool_size: int = 2  # Number of model replicas (each one holds its own copy in RAM)
+    whisper_pool_max_waiting: int = 8  # Requests allowed to wait for a free replica before 503
+    whisper_pool_acquire_timeout: float = 300.0  # Seconds a request waits for a replica (once per job, not per window)
+    # Nhiều model cùng lúc: request có thể chọn model_size (hoặc "auto" theo độ dài audio)
+    whisper_memory_budget_mb: int = 4096  # Idle replicas of least recently used models are unloaded to stay under this
+    whisper_model_idle_seconds: float = 900.0  # Unload a model nobody has used for this long
+    whisper_auto_model_rules: List[Tuple[float, str]] = [(120.0, "small"), (3600.0, "base"), (1e9, "tiny")]  # (max seconds, model size)
+    # Decoding profiles: đánh đổi độ chính xác lấy latency ổn định (chọn theo request qua form field "profile")
+    whisper_decoding_profile: str = "balanced"  # Default profile
+    whisper_decoding_profiles: Dict[str, dict] = {
+        # Greedy, no temperature fallback: predictable latency, may repeat itself on noisy audio
+        "fast": {
+            "beam_size": None, "best_of": None, "temperature": [0.0],
+            "compression_ratio_threshold": 2.4, "logprob_threshold": -1.0, "no_speech_threshold": 0.6,
+            "condition_on_previous_text": False,
+        },
+        # Greedy first, at most two sampled retries
+        "balanced": {
+            "beam_size": None, "best_of": 2, "temperature": [0.0, 0.4, 0.8],
+            "compression_ratio_threshold": 2.4, "logprob_threshold": -1.0, "no_speech_threshold": 0.6,
+            "condition_on_previous_text": False,
+        },
+        # Beam search plus the full fallback ladder (Whisper CLI defaults)
+        "accurate": {
+            "beam_size": 5, "best_of": 5, "temperature": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+            "compression_ratio_threshold": 2.4, "logprob_threshold": -1.0, "no_speech_threshold": 0.6,
+            "condition_on_previous_text": True,
+        },
+    }
+    # Chia CPU cores giữa các job Whisper chạy đồng thời (tránh oversubscription)
+    whisper_cpu_allocation: bool = True  # Each job gets torch.set_num_threads = cores / whisper_pool_size
+    whisper_min_threads_per_job: int = 1
+    whisper_cpu_pinning: bool = False  # Also pin each job's thread to its cores (Linux only)
+    whisper_interop_threads: int = 1
+    # Shared inference server (python -m services.whisper_server) - để trống thì mỗi worker tự load model
+    whisper_server_address: Optional[str] = None  # e.g. "127.0.0.1:8765"
+    # Bắt buộc khi dùng server: kết nối unpickle mọi thứ nhận được, ai biết key là chạy được code trên server
+    whisper_server_authkey: Optional[str] = None  # Long random secret shared by server and workers
+    # Long recordings are split into overlapping windows transcribed in parallel on the pool
+    whisper_long_audio_seconds: float = 600.0  # Audio at least this long uses chunked mode (also in /process-full)
+    whisper_chunk_seconds: float = 120.0  # Target window length
+    whisper_chunk_overlap_seconds: float = 3.0  # Audio shared by neighbouring windows
+    whisper_chunk_silence_search_seconds: float = 5.0  # How far to look for a quiet cut point
+    # Silence trimming before Whisper (timestamps are mapped back to the original audio)
+    whisper_vad_trim: bool = True
+    whisper_vad_threshold_db: float = -45.0  # Frames quieter than this (dBFS) count as silence
+    whisper_vad_relative_db: float = 35.0  # ...and for quiet recordings, frames this far below the loudest 5% (0 = off)
+    whisper_vad_min_silence_seconds: float = 1.0  # Shorter pauses are kept as-is
+    whisper_vad_padding_seconds: float = 0.25  # Silence kept on each side of speech
+    # Two-tier mode: chỉ chạy lại các đoạn có độ tin cậy thấp bằng model lớn hơn
+    whisper_refine_enabled: bool = False
+    whisper_refine_model_size: str = "small"  # Model used for the second pass
+    whisper_refine_logprob_threshold: float = -1.0  # Segments with avg_logprob below this are re-run
+    whisper_refine_compression_ratio_threshold: float = 2.4  # ...or with a higher compression ratio (repetition)
+    whisper_refine_no_speech_threshold: float = 0.6  # Segments that are probably silence are left alone
+    whisper_refine_padding_seconds: float = 0.3  # Context added around each re-run region
+    # Batched transcription (/speech-to-text/batch) - gộp nhiều clip ngắn vào một batch của model
+    whisper_batch_max_size: int = 8  # Clips decoded together in one encoder/decoder pass
+    whisper_batch_max_wait_ms: int = 50  # How long the first clip waits for others to join its batch
+    whisper_batch_max_clips: int = 64  # Files accepted per batch request
+    # Transcript cache - re-upload cùng một file audio sẽ trả kết quả ngay
+    transcript_cache_enabled: bool = True
+    transcript_cache_dir: str = ".cache/transcripts"
+    transcript_cache_max_mb: int = 256
+    # Decoded audio cache (float16 .npy, memory-mapped) - retry hoặc đổi model không phải decode lại
+    pcm_cache_enabled: bool = True
+    pcm_cache_dir: str = ".cache/pcm"
+    pcm_cache_max_mb: int = 2048
+    # Resumable chunked upload (/uploads) - transcription bắt đầu trong lúc file vẫn đang được upload
+    # Sessions live in the memory of the worker that created them: run the /uploads API with a single uvicorn worker
+    # (or route every request of an upload to the same worker); other workers answer 404 for an upload they do not own
+    upload_dir: str = ".cache/uploads"
+    upload_max_mb: int = 2048  # Largest recording accepted per upload
+    upload_max_sessions: int = 8  # Uploads in progress per worker
+    upload_session_ttl_seconds: float = 3600.0  # Idle uploads are dropped after this
+    # Realtime streaming STT (WebSocket /ws/speech-to-text)
+    stt_stream_max_sessions: int = 4  # Concurrent live streams per worker
+    stt_stream_partial_interval_seconds: float = 1.0  # Minimum gap between partial hypotheses
+    stt_stream_endpoint_silence_ms: int = 600  # Silence that ends an utterance
+    stt_stream_max_utterance_seconds: float = 20.0  # Force a final before Whisper's 30s window
+    stt_stream_vad_threshold: float = 0.01  # Frame RMS above this counts as speech
+    stt_stream_decoding_profile: str = "fast"  # Partials are re-decoded often, keep them cheap
+    # Diarization cho audio input: "acoustic" = phân cụm giọng nói từ audio (không gọi LLM), "llm" = diarize() cũ
+    diarization_backend: str = "acoustic"  # Options: acoustic, llm
+    acoustic_diarization_threshold: float = 0.9  # Average-linkage distance (voice-spread units) above which clusters are different speakers
+    acoustic_diarization_max_speakers: int = 8
+    acoustic_diarization_min_segment_seconds: float = 0.8  # Shorter segments inherit the previous speaker
+    # /process-full pipeline: transcript được clean theo từng đoạn trong lúc Whisper vẫn đang chạy
+    pipeline_clean_chunk_chars: int = 1500  # Whole sentences buffered before a chunk is sent to clean
+    pipeline_clean_concurrency: int = 4  # Clean calls running at the same time per request
+
     # Embedding Model for Vector-based Extraction (optional)
     # Options: "sentence-transformers/all-MiniLM-L6-v2" (fast, lightweight)
     #          "sentence-transformers/all-mpnet-base-v2" (better quality, slower)
@@ -22,6 +115,30 @@ class Settings(BaseSettings):
     vector_similarity_threshold: float = 0.7  # Minimum similarity score for retrieval
     top_k_examples: int = 5  # Number of similar examples to retrieve
     
+    # LLM gateway (services/llm.py) - clean, diarize, extract và summarize dùng chung một client cho mỗi provider
+    llm_openai_model: str = "gpt-4o-mini"
+    llm_temperature: float = 0.1
+    llm_timeout_seconds: float = 120.0
+    llm_max_retries: int = 2  # SDK retries (connection errors, 5xx) before falling back to Gemini
+    llm_rate_limit_retries: int = 2  # Retries of a rate-limited (429) call, after the SDK's own
+    llm_rate_limit_backoff_seconds: float = 2.0  # First backoff after a 429, doubled on each retry
+    llm_max_connections: int = 20  # Pooled keep-alive connections to OpenAI
+    llm_max_concurrency: int = 8  # Blocking calls in flight per provider (each holds a thread)
+    llm_max_async_concurrency: int = 256  # Async calls in flight per provider (no thread while waiting)
+    llm_gemini_model_ttl_seconds: float = 3600.0  # Gemini model list is re-fetched in the background this often
+    # Circuit breaker mỗi provider/model - provider đang lỗi (429, hết quota, sập) bị bỏ qua thay vì thử lại mỗi lần
+    llm_breaker_window: int = 20  # Recent calls the error rate is computed over
+    llm_breaker_min_calls: int = 5  # Calls in the window before the error rate can open the circuit
+    llm_breaker_failure_rate: float = 0.5  # Share of failed or slow calls that opens the circuit
+    llm_breaker_slow_call_seconds: float = 60.0  # Successful calls slower than this count as failures
+    llm_breaker_open_seconds: float = 30.0  # Cool-down before a background probe checks the provider again
+    # LLM response cache - cùng prompt gửi lại (retry, /clean rồi /extract, sửa trên UI) trả kết quả ngay, không tốn API
+    llm_cache_enabled: bool = True
+    llm_cache_path: str = ".cache/llm.sqlite3"
+    llm_cache_max_mb: int = 256
+    llm_cache_memory_entries: int = 512  # Completions kept in the in-memory LRU in front of SQLite
+    llm_cache_ttl_seconds: float = 7 * 24 * 3600.0  # Older completions are fetched again (0 = never expire)
+
     # API Keys
     # OpenAI API Key - ưu tiên sử dụng, nếu hết hạn sẽ fallback sang Gemini
     openai_api_key: Optional[str] = None  # Đọc từ env variable OPENAI_API_KEY
@@ -1,19 +1,33 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import tempfile
-from pathlib import Path
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Optional, List, Dict, Any
 import traceback
 import json
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 
-from services.stt import transcribe_audio
-from services.clean import clean_transcript
-from services.summarization import summarize
-from services.diarization import diarize
-from services.extraction import extract_actions_and_decisions
+from services.stt import (
+    transcribe_audio,
+    get_stt_stats,
+    evict_idle_models,
+    is_valid_model_size,
+    is_valid_profile,
+    audio_digest,
+    decode_audio_cached,
+    WhisperPoolBusy,
+)
+from services.batching import transcribe_batch
+from services.streaming import open_session, close_session, get_streaming_stats
+from services.uploads import create_upload, get_upload, close_upload, expire_uploads, UploadConflict
+from services.clean import clean_transcript_async
+from services.pipeline import transcribe_and_clean, clean_text as clean_text_chunked
+from services.summarization import summarize_async, summarize_stream
+from services.diarization import diarize_async
+from services.acoustic_diarization import diarize_audio
+from services.captions import parse_captions, has_speakers, speaker_turns, captions_text
+from services.extraction import extract_actions_and_decisions_async, extract_actions_and_decisions_stream
+from services.cpu_allocator import configure_interop_threads
+from services.llm import get_llm_stats, get_breaker_states, start_gemini_refresher
 from schemas.mom import ActionItem, Decision
 from core.config import settings
 
@@ -35,21 +49,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Thread pool executor for running CPU-bound tasks in parallel
-_executor = ThreadPoolExecutor(max_workers=4)
-
 @app.get("/health")
 async def health():
     return {"status": "ok", "service": "AI Service"}
 
+@app.get("/stt/stats")
+async def stt_stats():
+    """Whisper replica pool usage"""
+    return {**get_stt_stats(), "streaming": get_streaming_stats()}
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Calls, errors and latency per LLM provider"""
+    return get_llm_stats()
+
+@app.get("/llm/breakers")
+async def llm_breakers():
+    """Circuit breaker state per LLM provider/model (closed, open or half_open)"""
+    return {"breakers": get_breaker_states()}
+
+async def _whisper_idle_reaper():
+    """Periodically unload Whisper models that have not been used for a while"""
+    while True:
+        await asyncio.sleep(max(1.0, settings.whisper_model_idle_seconds / 4))
+        try:
+            await asyncio.to_thread(evict_idle_models)
+        except Exception as e:
+            print(f"Could not evict idle Whisper models: {e}")
+        expire_uploads()
+
 @app.on_event("startup")
 async def startup_event():
     """Load vector database on startup"""
+    configure_interop_threads()  # before the first model runs, or torch refuses
+    if settings.whisper_server_address:
+        from services.whisper_server import _authkey
+        _authkey()  # refuse to start without the shared secret
     if load_vector_db:
         try:
             load_vector_db()
         except Exception as e:
             print(f"Could not load vector database: {e}")
+    app.state.whisper_reaper = asyncio.create_task(_whisper_idle_reaper())
+    if settings.google_api_key:
+        # Resolve the Gemini fallback model up front, off the event loop
+        asyncio.create_task(asyncio.to_thread(start_gemini_refresher))
 
 @app.post("/vector-db/add-example")
 async def add_example(
@@ -113,27 +157,168 @@ async def save_db():
 @app.post("/speech-to-text")
 async def speech_to_text(
     audio: UploadFile = File(...),
-    language: Optional[str] = Form(default="vi")
+    language: Optional[str] = Form(default="vi"),
+    model_size: Optional[str] = Form(default=None),  # tiny/base/small/..., or "auto"
+    profile: Optional[str] = Form(default=None)  # Decoding profile: fast, balanced, accurate
 ):
     """Convert audio file to text using Speechmatics API"""
+    if not is_valid_model_size(model_size):
+        raise HTTPException(status_code=400, detail=f"Unknown Whisper model size: {model_size}")
+    if not is_valid_profile(profile):
+        raise HTTPException(status_code=400, detail=f"Unknown decoding profile: {profile}")
+    try:
+        # Decoded in memory, no temp file
+        data = await audio.read()
+        transcript = await transcribe_audio(data, language, model_size, profile)
+        return {"transcript": transcript}
+    except WhisperPoolBusy as e:
+        raise HTTPException(status_code=503, detail=f"Speech-to-text busy: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Speech-to-text failed: {str(e)}")
+
+@app.post("/speech-to-text/batch")
+async def speech_to_text_batch(
+    audios: List[UploadFile] = File(...),
+    language: Optional[str] = Form(default="vi"),
+    model_size: Optional[str] = Form(default=None),  # tiny/base/small/..., or "auto"
+    profile: Optional[str] = Form(default=None)  # Decoding profile: fast, balanced, accurate
+):
+    """Transcribe many short clips in one request; short clips share Whisper batches"""
+    if len(audios) > settings.whisper_batch_max_clips:
+        raise HTTPException(status_code=400, detail=f"Too many files (max {settings.whisper_batch_max_clips})")
+    if not is_valid_model_size(model_size):
+        raise HTTPException(status_code=400, detail=f"Unknown Whisper model size: {model_size}")
+    if not is_valid_profile(profile):
+        raise HTTPException(status_code=400, detail=f"Unknown decoding profile: {profile}")
+    try:
+        clips = [await audio.read() for audio in audios]
+        results = await transcribe_batch(clips, language, model_size, profile)
+        return {
+            "results": [
+                {"filename": audio.filename, "error": result["error"]} if "error" in result
+                else {"filename": audio.filename, "transcript": result["text"], "segments": result["segments"]}
+                for audio, result in zip(audios, results)
+            ]
+        }
+    except WhisperPoolBusy as e:
+        raise HTTPException(status_code=503, detail=f"Speech-to-text busy: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Speech-to-text failed: {str(e)}")
+
+@app.post("/uploads")
+async def upload_init(
+    language: Optional[str] = Form(default="vi"),
+    model_size: Optional[str] = Form(default=None),  # tiny/base/small/..., or "auto"
+    profile: Optional[str] = Form(default=None),  # Decoding profile: fast, balanced, accurate
+    duration_seconds: Optional[float] = Form(default=None)  # Lets model_size="auto" pick before the end arrives
+):
+    """Start a resumable upload; send the audio with POST /uploads/{id}/chunks?offset=N"""
+    if not is_valid_model_size(model_size):
+        raise HTTPException(status_code=400, detail=f"Unknown Whisper model size: {model_size}")
+    if not is_valid_profile(profile):
+        raise HTTPException(status_code=400, detail=f"Unknown decoding profile: {profile}")
+    try:
+        session = create_upload(language, model_size, profile, duration_seconds)
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return session.status()
+
+def _upload_or_404(upload_id: str):
+    session = get_upload(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired upload")
+    return session
+
+@app.post("/uploads/{upload_id}/chunks")
+async def upload_append(upload_id: str, request: Request, offset: int = 0):
+    """Append the raw request body at byte `offset`; transcription of complete windows starts right away.
+    A 409 means the offset is past what was received: resume from the returned `received`."""
+    session = _upload_or_404(upload_id)
+    try:
+        chunk = await request.body()
+        await session.append(offset, chunk)
+        return session.status()
+    except UploadConflict as e:
+        return JSONResponse(status_code=409, content={"detail": str(e), "received": e.received})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Bytes received so far (where to resume) and transcription progress"""
+    return _upload_or_404(upload_id).status()
+
+@app.post("/uploads/{upload_id}/finalize")
+async def upload_finalize(upload_id: str):
+    """Mark the upload complete and return the transcript once the last windows are done"""
+    session = _upload_or_404(upload_id)
     try:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            target = Path(tmpdir) / (audio.filename or "audio_input")
-            data = await audio.read()
-            target.write_bytes(data)
-            
-            transcript = await transcribe_audio(str(target), language)
-            return {"transcript": transcript}
+        result = await session.finalize()
+        return {"transcript": result["text"], "segments": result["segments"]}
+    except WhisperPoolBusy as e:
+        raise HTTPException(status_code=503, detail=f"Speech-to-text busy: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Speech-to-text failed: {str(e)}")
 
+@app.delete("/uploads/{upload_id}")
+async def upload_delete(upload_id: str):
+    """Abort an upload (or free a finished one) and delete its file"""
+    _upload_or_404(upload_id)
+    close_upload(upload_id)
+    return {"status": "deleted"}
+
+@app.websocket("/ws/speech-to-text")
+async def speech_to_text_stream(
+    websocket: WebSocket,
+    language: Optional[str] = "vi",
+    encoding: str = "pcm_s16le",
+    sample_rate: int = 16000
+):
+    """Realtime STT: binary PCM frames in, {"type": "partial"|"final", "text": ...} JSON events out.
+    Send the text message "stop" to flush the last utterance and close the stream."""
+    await websocket.accept()
+    try:
+        session = open_session(language, encoding, sample_rate)
+    except ValueError as e:
+        await websocket.close(code=1003, reason=str(e))
+        return
+    if session is None:
+        await websocket.close(code=1013, reason="Too many live streams, try again later")
+        return
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                for event in await session.push(message["bytes"]):
+                    await websocket.send_json(event)
+            elif message.get("text") == "stop":
+                for event in await session.flush():
+                    await websocket.send_json(event)
+                await websocket.send_json({"type": "end"})
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Streaming STT error: {type(e).__name__}: {str(e)}")
+        try:
+            await websocket.send_json({"type": "error", "detail": str(e)})
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        close_session(session)
+
 @app.post("/clean")
 async def clean_text(
     text: str = Form(...)
 ):
     """Clean and normalize transcript text"""
     try:
-        cleaned = clean_transcript(text)
+        cleaned = await clean_transcript_async(text)
         return {"cleaned_text": cleaned}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Text cleaning failed: {str(e)}")
@@ -149,18 +334,43 @@ async def summarize_text(
         if not sentences:
             raise HTTPException(status_code=400, detail="No meaningful content found")
         
-        structured_summary = summarize(sentences, language)
+        structured_summary = await summarize_async(sentences, language)
         return structured_summary
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Summarization failed: {str(e)}")
 
+def _ndjson(events, failure: str) -> StreamingResponse:
+    """One JSON event per line, flushed as soon as it is produced; errors become a final {"event": "error"}"""
+    async def lines():
+        try:
+            async for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"{failure}: {type(e).__name__}: {e}")
+            yield json.dumps({"event": "error", "detail": f"{failure}: {e}"}, ensure_ascii=False) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _sentences(text: str) -> List[str]:
+    return [s.strip() for s in text.replace("\n", " ").split(".") if s.strip()]
+
+@app.post("/summarize/stream")
+async def summarize_text_stream(
+    text: str = Form(...),
+    language: str = Form(default="vi")
+):
+    """/summarize as NDJSON: title, fields and table-of-content entries as the model writes them, then the full summary"""
+    sentences = _sentences(text)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="No meaningful content found")
+    return _ndjson(summarize_stream(sentences, language), "Summarization failed")
+
 @app.post("/diarize")
 async def diarize_text(
     text: str = Form(...)
 ):
     """Perform speaker diarization on text"""
     try:
-        segments = diarize(text)
+        segments = await diarize_async(text)
         return {"segments": [{"speaker": speaker, "text": text} for speaker, text in segments]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Diarization failed: {str(e)}")
@@ -176,9 +386,9 @@ async def extract_content(
             raise HTTPException(status_code=400, detail="No meaningful content found")
         
         # Try to get diarization data for better extraction
-        cleaned = clean_transcript(text)
-        segments = diarize(cleaned)
-        actions, decisions = extract_actions_and_decisions(sentences, segments)
+        cleaned = await clean_transcript_async(text)
+        segments = await diarize_async(cleaned)
+        actions, decisions = await extract_actions_and_decisions_async(sentences, segments)
         
         # Ensure we always return valid lists
         if actions is None:
@@ -209,37 +419,92 @@ async def extract_content(
         print(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Extraction failed: {str(e)}")
 
+@app.post("/extract/stream")
+async def extract_content_stream(
+    text: str = Form(...)
+):
+    """/extract as NDJSON: each action item and decision as soon as the model has written it, then the full lists"""
+    sentences = _sentences(text)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="No meaningful content found")
+    return _ndjson(extract_actions_and_decisions_stream(sentences), "Extraction failed")
+
+async def _diarize_acoustic(load_samples, stt_segments: List[dict], cleaned: str):
+    """Speaker labels from the voices in the recording; falls back to the LLM diarizer"""
+    try:
+        samples = await asyncio.to_thread(load_samples)  # PCM cache hit after STT
+        segments = await asyncio.to_thread(diarize_audio, samples, stt_segments)
+        if segments:
+            return segments
+    except Exception as e:
+        print(f"Acoustic diarization failed, using LLM diarization: {e}")
+    return await diarize_async(cleaned)
+
+async def _given_segments(segments):
+    return segments
+
 @app.post("/process-full")
 async def process_full(
     audio: Optional[UploadFile] = File(default=None),
     transcript: Optional[UploadFile] = File(default=None),
-    language: Optional[str] = Form(default="vi")
+    language: Optional[str] = Form(default="vi"),
+    model_size: Optional[str] = Form(default=None),  # tiny/base/small/..., or "auto"
+    profile: Optional[str] = Form(default=None),  # Decoding profile: fast, balanced, accurate
+    upload_id: Optional[str] = Form(default=None)  # Audio sent through /uploads instead of `audio`
 ):
     """Full processing pipeline: STT -> Clean -> (Summarize || Diarize) -> Extract
+
+    `transcript` may be plain text or an SRT/WebVTT/speaker-JSON export; when every cue
+    carries a speaker label, Clean and Diarize are skipped and the labels are used as is.
     
     Optimized to run summarize and diarize in parallel for better performance.
+    STT and cleaning are pipelined: each transcribed window is cleaned while Whisper
+    is still decoding the rest, so analysis starts right after the last window.
     """
+    if not is_valid_model_size(model_size):
+        raise HTTPException(status_code=400, detail=f"Unknown Whisper model size: {model_size}")
+    if not is_valid_profile(profile):
+        raise HTTPException(status_code=400, detail=f"Unknown decoding profile: {profile}")
+    finished_upload = None  # Closed once the response is built; a failed finalize can be retried
     try:
         raw_text: Optional[str] = None
+        load_samples = None  # Decoded audio for acoustic diarization
+        stt_segments: List[dict] = []
+        caption_turns: Optional[List[tuple]] = None
 
-        # Step 1: Get raw text (STT if audio, or read transcript)
+        # Step 1 + 2: Get raw text (STT if audio, or read transcript) and clean it chunk by chunk
         if audio is not None:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                target = Path(tmpdir) / (audio.filename or "audio_input")
-                data = await audio.read()
-                target.write_bytes(data)
-                raw_text = await transcribe_audio(str(target), language)
+            audio_data = await audio.read()
+            digest = await asyncio.to_thread(audio_digest, audio_data)  # transcript and PCM cache key
+            raw_text, cleaned, stt_segments = await transcribe_and_clean(audio_data, language, model_size, profile, digest)
+            load_samples = lambda: decode_audio_cached(audio_data, digest)
+        elif upload_id is not None:
+            # Most windows were transcribed while the file was still uploading
+            session = _upload_or_404(upload_id)
+            result = await session.finalize()
+            finished_upload = upload_id
+            raw_text, stt_segments = result["text"], result["segments"]
+            cleaned = await clean_text_chunked(raw_text) if raw_text.strip() else ""
+            load_samples = session.samples
         elif transcript is not None:
             data = await transcript.read()
             raw_text = data.decode("utf-8", errors="ignore")
+            captions = parse_captions(raw_text, transcript.filename)
+            if captions is not None:
+                # SRT/VTT/JSON export: drop timestamps and cue numbers before anything reads the text
+                raw_text = captions_text(captions)
+            if has_speakers(captions):
+                # Platform captions are already punctuated and attributed: no LLM clean or diarize
+                caption_turns = speaker_turns(captions)
+                cleaned = raw_text
+            else:
+                cleaned = await clean_text_chunked(raw_text) if raw_text.strip() else ""
         else:
             raise HTTPException(status_code=400, detail="No input file provided")
 
         if not raw_text or not raw_text.strip():
             raise HTTPException(status_code=400, detail="No content found in the uploaded file")
 
-        # Step 2: Clean text (must be done first)
-        cleaned = await asyncio.to_thread(clean_transcript, raw_text)
         sentences = [s.strip() for s in cleaned.replace("\n", " ").split(".") if s.strip()]
         
         if not sentences:
@@ -247,8 +512,13 @@ async def process_full(
         
         # Step 3: Run summarize and diarize in parallel (they are independent)
         # Both can run simultaneously since they don't depend on each other
-        structured_summary_task = asyncio.to_thread(summarize, sentences, language)
-        segments_task = asyncio.to_thread(diarize, cleaned)
+        structured_summary_task = summarize_async(sentences, language)
+        if caption_turns is not None:
+            segments_task = _given_segments(caption_turns)
+        elif load_samples is not None and stt_segments and settings.diarization_backend == "acoustic":
+            segments_task = _diarize_acoustic(load_samples, stt_segments, cleaned)
+        else:
+            segments_task = diarize_async(cleaned)
         
         # Wait for both to complete
         structured_summary, segments = await asyncio.gather(
@@ -274,11 +544,7 @@ async def process_full(
             structured_summary = {}
         
         # Step 4: Extract action items and decisions (depends on diarization)
-        actions, decisions = await asyncio.to_thread(
-            extract_actions_and_decisions, 
-            sentences, 
-            segments
-        )
+        actions, decisions = await extract_actions_and_decisions_async(sentences, segments)
         
         # Ensure we always return valid lists
         if actions is None:
@@ -308,10 +574,16 @@ async def process_full(
     
     except HTTPException:
         raise
+    except WhisperPoolBusy as e:
+        raise HTTPException(status_code=503, detail=f"Speech-to-text busy: {str(e)}")
     except Exception as e:
         print(f"Unexpected error in process_full: {type(e).__name__}: {str(e)}")
         print(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    finally:
+        if finished_upload is not None:
+            # Frees the .part file and the session slot instead of waiting for the TTL
+            close_upload(finished_upload)
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc: Exception):
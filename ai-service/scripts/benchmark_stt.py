@@ -0,0 +1,108 @@
+"""
+Script để so sánh tốc độ và độ chính xác giữa các Whisper backend (float vs int8)
+
+Sample set: một thư mục chứa file audio, mỗi file có file .txt cùng tên chứa transcript chuẩn
+    samples/meeting1.wav
+    samples/meeting1.txt
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.audio import SAMPLE_RATE, load_audio
+from services.stt import load_whisper_model
+from core.config import settings
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".flac", ".ogg", ".webm", ".mp4"}
+
+def _words(text: str):
+    return re.sub(r"[^\w\s]", " ", text.lower()).split()
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level Levenshtein distance divided by the reference length"""
+    ref = _words(reference)
+    hyp = _words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(
+                previous[j] + 1,        # deletion
+                current[j - 1] + 1,     # insertion
+                previous[j - 1] + (ref_word != hyp_word),  # substitution
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+def load_samples(samples_dir: str):
+    samples = []
+    for audio_path in sorted(Path(samples_dir).iterdir()):
+        if audio_path.suffix.lower() not in AUDIO_EXTENSIONS:
+            continue
+        reference_path = audio_path.with_suffix(".txt")
+        if not reference_path.exists():
+            print(f"  ⚠️  No reference transcript for {audio_path.name}, skipping")
+            continue
+        samples.append((audio_path.name, load_audio(str(audio_path)), reference_path.read_text(encoding="utf-8")))
+    return samples
+
+def benchmark_backend(backend: str, model_size: str, samples, language: str):
+    print(f"\n🔨 Loading {model_size} ({backend})...")
+    model = load_whisper_model(model_size, backend)
+
+    total_audio = 0.0
+    total_elapsed = 0.0
+    total_wer = 0.0
+    for name, audio, reference in samples:
+        started = time.perf_counter()
+        result = model.transcribe(audio, language=language if language != "auto" else None, fp16=False)
+        elapsed = time.perf_counter() - started
+        duration = len(audio) / SAMPLE_RATE
+        wer = word_error_rate(reference, result.get("text", ""))
+
+        total_audio += duration
+        total_elapsed += elapsed
+        total_wer += wer
+        print(f"  {name}: RTF {elapsed / duration:.3f}, WER {wer:.3f}")
+
+    return {
+        "rtf": total_elapsed / total_audio if total_audio else 0.0,
+        "wer": total_wer / len(samples) if samples else 0.0,
+    }
+
+def run_benchmark(samples_dir: str, model_size: str, language: str, backends):
+    print(f"📖 Loading samples from: {samples_dir}")
+    samples = load_samples(samples_dir)
+    if not samples:
+        print("❌ No samples found (need audio files with matching .txt references)")
+        return
+
+    # Every backend sees the same decoded audio
+    results = {backend: benchmark_backend(backend, model_size, samples, language) for backend in backends}
+
+    baseline = results[backends[0]]
+    print(f"\n✅ {len(samples)} samples, model {model_size}")
+    print(f"{'backend':<10}{'RTF':>10}{'WER':>10}{'speedup':>10}{'ΔWER':>10}")
+    for backend, result in results.items():
+        speedup = baseline["rtf"] / result["rtf"] if result["rtf"] else 0.0
+        print(f"{backend:<10}{result['rtf']:>10.3f}{result['wer']:>10.3f}{speedup:>9.2f}x{result['wer'] - baseline['wer']:>+10.3f}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark Whisper backends (real-time factor and WER)")
+    parser.add_argument("--samples", "-s", required=True, help="Directory with audio files and .txt references")
+    parser.add_argument("--model-size", "-m", default=settings.whisper_model_size, help="Whisper model size")
+    parser.add_argument("--language", "-l", default="vi", help="Language code, or 'auto'")
+    parser.add_argument("--backends", "-b", default="float,int8", help="Comma-separated backends; the first one is the baseline")
+
+    args = parser.parse_args()
+
+    run_benchmark(args.samples, args.model_size, args.language, [b.strip() for b in args.backends.split(",") if b.strip()])
@@ -9,7 +9,7 @@ from pathlib import Path
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from services.extraction import _generate_with_llm
+from services.llm import generate
 from core.config import settings
 
 # System prompt để extract structured data
@@ -106,7 +106,7 @@ def generate_with_local_llm(transcript: str) -> str:
     
     try:
         print("  Generating with local LLM...")
-        output = _generate_with_llm(prompt, max_new_tokens=2048)
+        output = generate(prompt, max_tokens=2048)
         
         # Clean output
         output = output.strip()
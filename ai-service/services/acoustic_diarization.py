@@ -0,0 +1,183 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from sklearn.cluster import AgglomerativeClustering
+except ImportError:
+    AgglomerativeClustering = None
+
+from core.config import settings
+from services.audio import SAMPLE_RATE
+
+# 25 ms analysis windows every 10 ms, 40 mel bands, 20 cepstral coefficients
+_WIN = int(0.025 * SAMPLE_RATE)
+_HOP = int(0.010 * SAMPLE_RATE)
+_N_FFT = 512
+_N_MELS = 40
+_N_MFCC = 20
+# Pitch: 40 ms frames so two periods of a 60 Hz voice fit; log-f0 differences of this size count as one unit
+_PITCH_WIN = int(0.040 * SAMPLE_RATE)
+_PITCH_RANGE_HZ = (60.0, 400.0)
+_PITCH_SCALE = 0.25
+
+# ------------------ FEATURES ------------------
+def _mel_filterbank(n_mels: int = _N_MELS, n_fft: int = _N_FFT, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Triangular mel filters, shape (n_mels, n_fft // 2 + 1)"""
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+    mel_points = np.linspace(hz_to_mel(60.0), hz_to_mel(sample_rate / 2 * 0.95), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mel_points) / sample_rate).astype(int)
+    filters = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            filters[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filters[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return filters
+
+def _dct_matrix(n_out: int = _N_MFCC, n_in: int = _N_MELS) -> np.ndarray:
+    """Orthonormal DCT-II basis, shape (n_out, n_in)"""
+    k = np.arange(n_out)[:, None]
+    n = np.arange(n_in)[None, :]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2 * n_in)) * np.sqrt(2.0 / n_in)
+    basis[0] /= np.sqrt(2.0)
+    return basis.astype(np.float32)
+
+_MEL_FILTERS = _mel_filterbank()
+_DCT = _dct_matrix()
+_WINDOW = np.hanning(_WIN).astype(np.float32)
+
+def mfcc(samples: np.ndarray) -> np.ndarray:
+    """MFCC frames for a 16 kHz signal, shape (n_frames, _N_MFCC); vectorized over frames"""
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < _WIN:
+        samples = np.pad(samples, (0, _WIN - len(samples)))
+    n_frames = 1 + (len(samples) - _WIN) // _HOP
+    frames = np.lib.stride_tricks.sliding_window_view(samples, _WIN)[::_HOP][:n_frames]
+    emphasized = frames - 0.97 * np.concatenate([frames[:, :1], frames[:, :-1]], axis=1)
+    spectrum = np.abs(np.fft.rfft(emphasized * _WINDOW, n=_N_FFT)) ** 2
+    log_mel = np.log(spectrum @ _MEL_FILTERS.T + 1e-10)
+    return log_mel @ _DCT.T
+
+def log_pitch(samples: np.ndarray) -> float:
+    """Median log-f0 over the louder frames (autocorrelation peak via FFT, all frames at once)"""
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < _PITCH_WIN:
+        return float("nan")
+    frames = np.lib.stride_tricks.sliding_window_view(samples, _PITCH_WIN)[::_HOP]
+    energy = np.sum(frames ** 2, axis=1)
+    frames = frames[energy >= np.median(energy)]
+    frames = frames - frames.mean(axis=1, keepdims=True)
+    power = np.abs(np.fft.rfft(frames * np.hanning(_PITCH_WIN), n=2 * _PITCH_WIN)) ** 2
+    autocorrelation = np.fft.irfft(power)[:, :_PITCH_WIN]
+    lo = int(SAMPLE_RATE / _PITCH_RANGE_HZ[1])
+    hi = int(SAMPLE_RATE / _PITCH_RANGE_HZ[0])
+    lags = lo + np.argmax(autocorrelation[:, lo:hi], axis=1)
+    return float(np.median(np.log(SAMPLE_RATE / lags)))
+
+def segment_embedding(samples: np.ndarray) -> np.ndarray:
+    """
+    Fixed-size voice embedding of one segment: mean and standard deviation of the
+    cepstral coefficients over its louder frames (c0, i.e. loudness, is dropped),
+    followed by the median log pitch.
+    """
+    coefficients = mfcc(samples)
+    if len(coefficients) > 4:
+        # Keep the louder half of the frames; pauses inside a segment carry no voice information
+        frame_energy = coefficients[:, 0]
+        coefficients = coefficients[frame_energy >= np.median(frame_energy)]
+    coefficients = coefficients[:, 1:]
+    return np.concatenate([coefficients.mean(axis=0), coefficients.std(axis=0), [log_pitch(samples)]])
+
+# ------------------ CLUSTERING ------------------
+def _cluster(embeddings: np.ndarray, n_speakers: Optional[int]) -> np.ndarray:
+    if AgglomerativeClustering is None:
+        raise ImportError("Install scikit-learn with: pip install scikit-learn")
+    if len(embeddings) == 1:
+        return np.zeros(1, dtype=int)
+
+    # Express the segment means in units of the typical frame-to-frame spread of a voice,
+    # so the threshold means the same thing whether the recording has one speaker or ten
+    dims = (embeddings.shape[1] - 1) // 2
+    means, spreads = embeddings[:, :dims], embeddings[:, dims:2 * dims]
+    timbre = means / (np.sqrt(np.mean(spreads ** 2, axis=0)) + 1e-8) / np.sqrt(dims)
+    pitch = embeddings[:, -1]
+    pitch = np.where(np.isnan(pitch), np.nanmedian(pitch) if not np.isnan(pitch).all() else 0.0, pitch)
+    scaled = np.column_stack([timbre, pitch / _PITCH_SCALE])
+
+    if n_speakers:
+        clustering = AgglomerativeClustering(n_clusters=min(n_speakers, len(embeddings)), linkage="average")
+    else:
+        clustering = AgglomerativeClustering(
+            n_clusters=None,
+            distance_threshold=settings.acoustic_diarization_threshold,
+            linkage="average",
+        )
+    labels = clustering.fit_predict(scaled)
+
+    max_speakers = settings.acoustic_diarization_max_speakers
+    if not n_speakers and len(set(labels)) > max_speakers:
+        labels = AgglomerativeClustering(n_clusters=max_speakers, linkage="average").fit_predict(scaled)
+    return labels
+
+# ------------------ PUBLIC API ------------------
+def diarize_audio(
+    audio: np.ndarray,
+    segments: List[dict],
+    n_speakers: Optional[int] = None,
+) -> List[Tuple[str, str]]:
+    """
+    Speaker diarization from the audio itself, without any network call.
+    `segments` are Whisper segments ({"start", "end", "text"}, seconds in `audio`).
+    Each segment gets a spectral embedding, the embeddings are clustered, and
+    consecutive segments of the same speaker are merged. Returns the same
+    [(speaker, text)] as diarize_async(), with speakers named "Speaker 1", "Speaker 2", ...
+    in order of first appearance.
+    """
+    usable = [s for s in segments if s.get("text", "").strip()]
+    if not usable:
+        return []
+
+    min_samples = int(settings.acoustic_diarization_min_segment_seconds * SAMPLE_RATE)
+    embeddings = []
+    has_voice = []
+    for segment in usable:
+        start = max(0, int(segment["start"] * SAMPLE_RATE))
+        end = min(len(audio), int(segment["end"] * SAMPLE_RATE))
+        clip = audio[start:end]
+        has_voice.append(len(clip) >= min_samples)
+        embeddings.append(segment_embedding(clip) if len(clip) else None)
+
+    # Too-short segments are unreliable: cluster the others and give short ones their neighbour's label
+    reliable = [i for i, ok in enumerate(has_voice) if ok and embeddings[i] is not None]
+    if not reliable:
+        reliable = [i for i, e in enumerate(embeddings) if e is not None]
+    if not reliable:
+        return [("Speaker 1", " ".join(s["text"].strip() for s in usable))]
+
+    labels = _cluster(np.stack([embeddings[i] for i in reliable]), n_speakers)
+    segment_labels = [None] * len(usable)
+    for i, label in zip(reliable, labels):
+        segment_labels[i] = int(label)
+    previous = segment_labels[reliable[0]]
+    for i in range(len(usable)):
+        if segment_labels[i] is None:
+            segment_labels[i] = previous
+        previous = segment_labels[i]
+
+    names = {}
+    diarized: List[Tuple[str, str]] = []
+    for segment, label in zip(usable, segment_labels):
+        speaker = names.setdefault(label, f"Speaker {len(names) + 1}")
+        text = segment["text"].strip()
+        if diarized and diarized[-1][0] == speaker:
+            diarized[-1] = (speaker, f"{diarized[-1][1]} {text}")
+        else:
+            diarized.append((speaker, text))
+    return diarized
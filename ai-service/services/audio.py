@@ -0,0 +1,254 @@
+from typing import List, Optional, Tuple
+import struct
+import subprocess
+import tempfile
+
+import numpy as np
+
+try:
+    import whisper
+except ImportError:
+    whisper = None
+
+# Whisper models always consume 16 kHz mono float32
+SAMPLE_RATE = 16000
+_FRAME_SECONDS = 0.02
+
+def load_audio(file_path: str) -> np.ndarray:
+    """Decode any ffmpeg-readable file into a 16 kHz mono float32 array"""
+    if whisper is None:
+        raise ImportError(
+            "Whisper is not installed. Please install it with: pip install openai-whisper"
+        )
+    return whisper.load_audio(file_path, sr=SAMPLE_RATE)
+
+# ------------------ IN-MEMORY DECODING ------------------
+def _decode_wav(data: bytes) -> Optional[np.ndarray]:
+    """
+    Decode an uncompressed 16 kHz WAV (PCM 8/16/24/32-bit or float32) straight from memory.
+    Returns None for anything this parser does not handle so the caller can use ffmpeg;
+    that includes other sample rates, which need ffmpeg's low-pass resampler (interpolating
+    44.1/48 kHz audio down to 16 kHz here would alias everything above 8 kHz into the speech band).
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack_from("<I", data, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate = struct.unpack_from("<HHI", data, body)
+            bits = struct.unpack_from("<H", data, body + 14)[0]
+            if audio_format == 0xFFFE and chunk_size >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: the real format is the first field of the sub-format GUID
+                audio_format = struct.unpack_from("<H", data, body + 24)[0]
+            if sample_rate != SAMPLE_RATE:
+                return None
+            fmt = (audio_format, channels, bits)
+        elif chunk_id == b"data" and fmt is not None:
+            audio_format, channels, bits = fmt
+            end = min(len(data), body + chunk_size)
+            frame_bytes = channels * bits // 8
+            if frame_bytes == 0:
+                return None
+            end -= (end - body) % frame_bytes
+            raw = memoryview(data)[body:end]
+
+            if audio_format == 3 and bits == 32:
+                samples = np.frombuffer(raw, dtype="<f4")
+            elif audio_format == 1 and bits == 16:
+                samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+            elif audio_format == 1 and bits == 32:
+                samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+            elif audio_format == 1 and bits == 8:
+                samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+            elif audio_format == 1 and bits == 24:
+                triplets = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+                ints = triplets[:, 0] | (triplets[:, 1] << 8) | (triplets[:, 2] << 16)
+                ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+                samples = ints.astype(np.float32) / 8388608.0
+            else:
+                return None
+
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+            return samples.astype(np.float32, copy=False)
+
+        offset = body + chunk_size + (chunk_size & 1)  # chunks are word aligned
+
+    return None
+
+def _ffmpeg_command(source: str) -> List[str]:
+    return [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", source,
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE),
+        "-loglevel", "error",
+        "pipe:1",
+    ]
+
+def _decode_with_ffmpeg(data: bytes) -> np.ndarray:
+    """Pipe the encoded bytes through ffmpeg and read 16 kHz mono PCM back from stdout"""
+    try:
+        proc = subprocess.run(_ffmpeg_command("pipe:0"), input=data, capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg is not installed or not on PATH")
+
+    if proc.returncode != 0 or not proc.stdout:
+        # Some containers (e.g. MP4/M4A with the index at the end) need a seekable input
+        print(f"ffmpeg could not decode from a pipe ({proc.stderr.decode(errors='ignore').strip()[:200]}), retrying from a temp file")
+        with tempfile.NamedTemporaryFile(suffix=".audio") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            proc = subprocess.run(_ffmpeg_command(tmp.name), capture_output=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Failed to decode audio: {proc.stderr.decode(errors='ignore').strip()}")
+
+    return np.frombuffer(proc.stdout, dtype="<i2").astype(np.float32) / 32768.0
+
+def decode_audio_bytes(data: bytes) -> np.ndarray:
+    """Decode an uploaded audio blob into a 16 kHz mono float32 array without touching disk"""
+    samples = _decode_wav(data)
+    if samples is not None:
+        return samples
+    return _decode_with_ffmpeg(data)
+
+def frame_rms(samples: np.ndarray, frame_len: int) -> np.ndarray:
+    """RMS energy per non-overlapping frame (the tail shorter than one frame is dropped)"""
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[: n_frames * frame_len].reshape(n_frames, frame_len)
+    # einsum accumulates in float32 without a float32 copy of a float16 (PCM cache) recording
+    return np.sqrt(np.einsum("ij,ij->i", frames, frames, dtype=np.float32) / frame_len)
+
+def next_window(
+    samples: np.ndarray,
+    start: int,
+    window_s: float,
+    overlap_s: float,
+    search_s: float,
+    final: bool = True,
+) -> Optional[Tuple[int, int, int]]:
+    """
+    One step of split_on_silence: the window beginning at sample `start`, as
+    (start, end, start of the next window; len(samples) after the last one).
+    With final=False the audio is still growing: returns None when not enough
+    of it has arrived yet to place this window's cut.
+    """
+    total = len(samples)
+    window = int(window_s * SAMPLE_RATE)
+    overlap = int(overlap_s * SAMPLE_RATE)
+    search = int(search_s * SAMPLE_RATE)
+    target = start + window
+    if target + search >= total:
+        return (start, total, total) if final else None
+
+    frame_len = int(_FRAME_SECONDS * SAMPLE_RATE)
+    lo = max(start + window // 2, target - search) // frame_len
+    hi = min(total, target + search) // frame_len
+    quiet = frame_rms(samples[lo * frame_len:hi * frame_len], frame_len)
+    cut = (lo + int(np.argmin(quiet))) * frame_len if len(quiet) else target
+    return start, min(total, cut + overlap // 2), max(0, cut - overlap // 2)
+
+def split_on_silence(
+    samples: np.ndarray,
+    window_s: float,
+    overlap_s: float,
+    search_s: float,
+) -> List[Tuple[int, int]]:
+    """
+    Split audio into overlapping windows of roughly `window_s` seconds.
+    Each cut is moved to the quietest frame within `search_s` of the target
+    boundary, so words are rarely split; windows then overlap by `overlap_s`
+    so the stitcher can deduplicate whatever still straddles the cut.
+    Returns (start, end) sample indices.
+    """
+    total = len(samples)
+    if total <= int(window_s * SAMPLE_RATE):
+        return [(0, total)]
+
+    windows = []
+    start = 0
+    while start < total:
+        start, end, next_start = next_window(samples, start, window_s, overlap_s, search_s)
+        windows.append((start, end))
+        start = next_start
+    return windows
+
+# ------------------ SILENCE TRIMMING ------------------
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start (inclusive) and end (exclusive) indices of the True runs in a boolean array"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def trim_silence(
+    samples: np.ndarray,
+    threshold_db: float,
+    min_silence_s: float,
+    padding_s: float,
+    relative_db: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Drop silent stretches longer than `min_silence_s`, keeping `padding_s` of
+    silence next to the speech on each side. Everything is vectorized over
+    20 ms frames.
+
+    A frame is silent below `threshold_db` (dBFS). With `relative_db` the threshold
+    also follows the recording's own level: it drops to `relative_db` below the
+    loudest 5% of frames, so quiet (low-gain, far-field) speech is not mistaken
+    for silence. A recording with no frame above the threshold is returned whole.
+
+    Returns the trimmed audio and a remap table: one row per kept region with
+    (start in trimmed audio, start in original audio), both in seconds.
+    """
+    frame_len = int(_FRAME_SECONDS * SAMPLE_RATE)
+    energy = frame_rms(samples, frame_len)
+    identity = np.zeros((1, 2), dtype=np.float64)
+    if not len(energy):
+        return samples, identity
+
+    level = 20.0 * np.log10(energy + 1e-10)
+    if relative_db is not None:
+        threshold_db = min(threshold_db, float(np.percentile(level, 95)) - relative_db)
+    voiced = level > threshold_db
+    if not voiced.any():
+        # Nothing stands out: better to let Whisper decide than to throw the recording away
+        return samples, identity
+
+    min_silence = max(1, int(min_silence_s / _FRAME_SECONDS))
+    padding = int(padding_s / _FRAME_SECONDS)
+    n_frames = len(energy)
+
+    keep = np.ones(n_frames, dtype=bool)
+    silence_starts, silence_ends = _runs(~voiced)
+    for start, end in zip(silence_starts, silence_ends):
+        if end - start < min_silence:
+            continue
+        drop_start = start if start == 0 else start + padding
+        drop_end = end if end == n_frames else end - padding
+        if drop_end > drop_start:
+            keep[drop_start:drop_end] = False
+
+    if keep.all():
+        return samples, identity
+
+    # The partial frame at the end follows the last full frame
+    sample_mask = np.ones(len(samples), dtype=bool)
+    sample_mask[: n_frames * frame_len] = np.repeat(keep, frame_len)
+    sample_mask[n_frames * frame_len:] = keep[-1]
+    trimmed = samples[sample_mask]
+
+    kept_starts, kept_ends = _runs(keep)
+    trimmed_starts = np.concatenate(([0], np.cumsum(kept_ends - kept_starts)[:-1]))
+    table = np.column_stack((trimmed_starts, kept_starts)).astype(np.float64) * _FRAME_SECONDS
+    return trimmed, table
+
+def remap_time(t: float, table: np.ndarray) -> float:
+    """Map a time in trimmed audio back to the original recording"""
+    row = max(0, int(np.searchsorted(table[:, 0], t, side="right")) - 1)
+    return float(table[row, 1] + (t - table[row, 0]))
@@ -0,0 +1,247 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import time
+
+import numpy as np
+
+try:
+    import whisper
+except ImportError:
+    whisper = None
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+from core.config import settings
+from services.audio import SAMPLE_RATE, trim_silence
+from services.cpu_allocator import cpu_job
+from services.stt import (
+    WhisperPoolBusy,
+    _cache_key_sync,
+    _cache_put,
+    _decode_sync,
+    _get_stt_executor,
+    _get_transcript_cache,
+    _get_whisper_pool,
+    _remap_segments,
+    _run_transcription,
+    _segment_dict,
+    _transcribe_window_sync,
+    audio_digest,
+    get_decoding_options,
+    is_valid_model_size,
+    resolve_model_size,
+)
+
+# Whisper decodes one 30 s window per batch item; longer clips use the regular path
+MAX_BATCH_CLIP_SECONDS = 30.0
+
+# ------------------ BATCHED DECODING ------------------
+def _whisper_language(language: Optional[str]) -> Optional[str]:
+    whisper_lang = language or "en"
+    return None if whisper_lang == "auto" else whisper_lang
+
+def _transcribe_batch_sync(
+    clips: List[np.ndarray], language: Optional[str], model_size: str, profile: Optional[str] = None
+) -> List[dict]:
+    """
+    Pad every clip to 30 s, stack the log-mel spectrograms and run them through the
+    encoder/decoder as one batch on a single leased replica. Clips whose first decode
+    fails the profile's quality gates are re-run with model.transcribe (temperature fallback).
+    """
+    if whisper is None or torch is None:
+        raise ImportError("Whisper is not installed. Please install it with: pip install openai-whisper")
+
+    whisper_lang = _whisper_language(language)
+    decoding = get_decoding_options(profile)
+    compression_ratio_threshold = decoding.get("compression_ratio_threshold") or float("inf")
+    logprob_threshold = decoding.get("logprob_threshold")
+    logprob_threshold = float("-inf") if logprob_threshold is None else logprob_threshold
+    no_speech_threshold = decoding.get("no_speech_threshold")
+    results: List[dict] = []
+    with _get_whisper_pool(model_size).lease() as model, cpu_job():
+        started = time.perf_counter()
+        n_mels = getattr(model.dims, "n_mels", 80)
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(np.asarray(clip, dtype=np.float32)), n_mels) for clip in clips
+        ]).to(model.device)
+        # First rung of the profile's ladder (temperature 0, beam search if the profile uses it)
+        options = whisper.DecodingOptions(
+            language=whisper_lang,
+            temperature=decoding["temperature"][0],
+            beam_size=decoding.get("beam_size") if decoding["temperature"][0] == 0 else None,
+            best_of=decoding.get("best_of") if decoding["temperature"][0] > 0 else None,
+            fp16=False,
+            without_timestamps=True,
+        )
+        decoded = whisper.decode(model, mel, options)
+
+        fallbacks = 0
+        for clip, result in zip(clips, decoded):
+            duration = len(clip) / SAMPLE_RATE
+            if (
+                no_speech_threshold is not None
+                and result.no_speech_prob > no_speech_threshold
+                and result.avg_logprob < logprob_threshold
+            ):
+                results.append({"text": "", "segments": []})
+                continue
+            failed = result.compression_ratio > compression_ratio_threshold or result.avg_logprob < logprob_threshold
+            if failed and len(decoding["temperature"]) > 1:
+                fallbacks += 1
+                single = model.transcribe(np.asarray(clip, dtype=np.float32), language=whisper_lang, fp16=False, **decoding)
+                results.append({
+                    "text": single.get("text", "").strip(),
+                    "segments": [_segment_dict(seg) for seg in single.get("segments", [])],
+                })
+                continue
+            segment = _segment_dict({
+                "start": 0.0,
+                "end": duration,
+                "text": result.text,
+                "avg_logprob": result.avg_logprob,
+                "no_speech_prob": result.no_speech_prob,
+                "compression_ratio": result.compression_ratio,
+            })
+            results.append({"text": segment["text"], "segments": [segment] if segment["text"] else []})
+
+    print(f"Batch of {len(clips)} clips ({model_size}) transcribed in {time.perf_counter() - started:.1f}s, {fallbacks} fallbacks")
+    return results
+
+# ------------------ MICRO-BATCHER ------------------
+class MicroBatcher:
+    """
+    Collects short clips submitted by concurrent requests and decodes them together.
+    A batch is flushed when it reaches `whisper_batch_max_size` clips or when the
+    oldest clip has waited `whisper_batch_max_wait_ms`. Clips are grouped by
+    (language, model size, profile) since one batch shares its decoding options.
+    Only touched from the event loop.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple, List[Tuple[np.ndarray, asyncio.Future]]] = {}
+        self._timers: Dict[Tuple, asyncio.TimerHandle] = {}
+
+    async def submit(self, clip: np.ndarray, language: Optional[str], model_size: str, profile: Optional[str] = None) -> dict:
+        loop = asyncio.get_running_loop()
+        key = (language, model_size, profile)
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((clip, future))
+
+        if len(batch) >= settings.whisper_batch_max_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(settings.whisper_batch_max_wait_ms / 1000, self._flush, key)
+        return await future
+
+    def _flush(self, key: Tuple) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self._run(key, batch))
+
+    async def _run(self, key: Tuple, batch: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        language, model_size, profile = key
+        loop = asyncio.get_running_loop()
+        try:
+            if settings.whisper_server_address:
+                # Replicas live in the inference server: send the clips one by one
+                results = await asyncio.gather(*[
+                    loop.run_in_executor(_get_stt_executor(), _transcribe_window_sync, clip, language, model_size, profile)
+                    for clip, _ in batch
+                ])
+            else:
+                results = await loop.run_in_executor(
+                    _get_stt_executor(), _transcribe_batch_sync, [clip for clip, _ in batch], language, model_size, profile
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+_batcher: Optional[MicroBatcher] = None
+
+def _get_batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher()
+    return _batcher
+
+# ------------------ PUBLIC API ------------------
+def _prepare_clip(data: bytes, digest: Optional[str] = None):
+    """Decode and trim one upload; returns (original audio, trimmed audio, remap table or None)"""
+    original = _decode_sync(data, digest)
+    if not settings.whisper_vad_trim:
+        return original, original, None
+    trimmed, remap = trim_silence(
+        original,
+        threshold_db=settings.whisper_vad_threshold_db,
+        min_silence_s=settings.whisper_vad_min_silence_seconds,
+        padding_s=settings.whisper_vad_padding_seconds,
+        relative_db=settings.whisper_vad_relative_db or None,
+    )
+    return original, trimmed, remap
+
+async def _transcribe_clip(data: bytes, language: Optional[str], model_size: Optional[str], profile: Optional[str]) -> dict:
+    cache = _get_transcript_cache()
+    cache_key = None
+    digest = await asyncio.to_thread(audio_digest, data)
+    if cache is not None:
+        cache_key = _cache_key_sync(digest, language, model_size, profile)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached:
+            return cached
+
+    loop = asyncio.get_running_loop()
+    original, audio, remap = await loop.run_in_executor(_get_stt_executor(), _prepare_clip, data, digest)
+    if not len(audio):
+        return {"text": "", "segments": []}
+
+    size = resolve_model_size(model_size, len(original) / SAMPLE_RATE)
+    if len(audio) / SAMPLE_RATE > MAX_BATCH_CLIP_SECONDS:
+        # Trims, transcribes and maps the times back by itself
+        result = await _run_transcription(loop, _get_stt_executor(), original, language, size, profile)
+    else:
+        result = await _get_batcher().submit(audio, language, size, profile)
+        _remap_segments(result["segments"], remap)
+    if result["text"]:
+        await _cache_put(cache, cache_key, result)
+    return result
+
+async def transcribe_batch(
+    clips: List[bytes],
+    language: Optional[str] = None,
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+) -> List[dict]:
+    """
+    Transcribe many uploaded clips at once. Clips of up to 30 s (after silence trimming)
+    are packed into shared Whisper batches, longer ones use the regular chunked path.
+    Returns one {"text", "segments"} or {"error"} per clip, in input order.
+    """
+    if not is_valid_model_size(model_size):
+        raise ValueError(f"Unknown Whisper model size: {model_size}")
+    get_decoding_options(profile)  # raises on an unknown profile
+
+    results = await asyncio.gather(
+        *[_transcribe_clip(data, language, model_size, profile) for data in clips],
+        return_exceptions=True,
+    )
+    output = []
+    for result in results:
+        if isinstance(result, WhisperPoolBusy):
+            raise result
+        if isinstance(result, Exception):
+            output.append({"error": f"Whisper transcription failed: {result}"})
+        else:
+            output.append(result)
+    return output
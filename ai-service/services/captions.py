@@ -0,0 +1,170 @@
+from typing import List, Optional, Tuple
+import json
+import re
+
+# "00:01:02,500 --> 00:01:04,000" (SRT) or "01:02.500 --> 01:04.000 align:start" (WebVTT)
+_CUE_TIMING = re.compile(
+    r"^\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{1,3})\s*-->\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{1,3})"
+)
+# WebVTT voice tag: <v Speaker Name>text</v> (optionally with classes: <v.loud Name>)
+_VTT_VOICE = re.compile(r"^<v(?:\.[\w.-]+)?\s+([^>]+)>")
+# Any other inline markup (<c>, <i>, <b>, timestamps <00:01.000>, ...)
+_TAG = re.compile(r"<[^>]*>")
+# "Name: text" or "[Name] text" prefixes used by SRT exports ("Note: ..." matches too, see _parse_cues)
+_NAME_PREFIX = re.compile(r"^(?:-\s*)?\[?([^\W\d_][\w .'-]{0,38}?)\]?\s*:\s+(.+)$", re.UNICODE)
+_BRACKET_PREFIX = re.compile(r"^(?:-\s*)?\[([^\]]{1,40})\]\s*(.+)$")
+
+# Keys tried in order when reading speaker JSON exports
+_JSON_LIST_KEYS = ("segments", "utterances", "transcript", "results", "items")
+_JSON_SPEAKER_KEYS = ("speaker", "speaker_name", "speaker_label", "name", "participant")
+_JSON_TEXT_KEYS = ("text", "transcript", "content", "words")
+_JSON_START_KEYS = ("start", "start_time", "startTime", "offset")
+_JSON_END_KEYS = ("end", "end_time", "endTime")
+
+def _timestamp(value: str) -> float:
+    parts = value.replace(",", ".").split(":")
+    seconds = float(parts[-1])
+    for i, part in enumerate(reversed(parts[:-1])):
+        seconds += int(part) * 60 ** (i + 1)
+    return seconds
+
+def _split_speaker(text: str) -> Tuple[Optional[str], str, bool]:
+    """(speaker, text, whether the speaker came from a "Name:" / "[Name]" prefix rather than a voice tag)"""
+    voice = _VTT_VOICE.match(text)
+    if voice:
+        return voice.group(1).strip(), _TAG.sub("", text).strip(), False
+    text = _TAG.sub("", text).strip()
+    for pattern in (_BRACKET_PREFIX, _NAME_PREFIX):
+        match = pattern.match(text)
+        if match and len(match.group(1).split()) <= 4:
+            return match.group(1).strip(), match.group(2).strip(), True
+    return None, text, False
+
+# ------------------ SRT / WEBVTT ------------------
+def _parse_cues(text: str) -> List[dict]:
+    """
+    Cues of an SRT or WebVTT file. A cue without a label has no speaker. "Name:" prefixes
+    only count as labels when every cue has one; otherwise they are ordinary text
+    ("Note: ...", "Q: ...") and are left in it.
+    """
+    segments: List[dict] = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n").replace("\r", "\n")):
+        lines = [line for line in block.strip().split("\n") if line.strip()]
+        timing_index = next((i for i, line in enumerate(lines) if _CUE_TIMING.match(line)), None)
+        if timing_index is None:
+            continue  # WEBVTT header, NOTE / STYLE / REGION blocks, stray numbering
+        timing = _CUE_TIMING.match(lines[timing_index])
+        speaker: Optional[str] = None
+        from_prefix = False
+        body = []
+        raw = []
+        for line in lines[timing_index + 1:]:
+            label, content, prefixed = _split_speaker(line.strip())
+            if label:
+                speaker, from_prefix = label, prefixed
+            if content:
+                body.append(content)
+            plain = _TAG.sub("", line).strip()
+            if plain:
+                raw.append(plain)
+        if body:
+            segments.append({
+                "start": _timestamp(timing.group(1)),
+                "end": _timestamp(timing.group(2)),
+                "speaker": speaker,
+                "text": " ".join(body),
+                "_raw": " ".join(raw) if from_prefix else None,
+            })
+
+    labelled = all(segment["speaker"] for segment in segments)
+    for segment in segments:
+        raw = segment.pop("_raw")
+        if raw is not None and not labelled:
+            segment["speaker"], segment["text"] = None, raw
+    return segments
+
+# ------------------ SPEAKER JSON ------------------
+def _first(item: dict, keys) -> Optional[object]:
+    for key in keys:
+        if item.get(key) is not None:
+            return item[key]
+    return None
+
+def _json_time(value) -> Optional[float]:
+    """Seconds from a number or an "hh:mm:ss.mmm" string; raises ValueError for anything else"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return _timestamp(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    raise ValueError(f"Not a time: {value!r}")
+
+def _parse_json(data) -> List[dict]:
+    if isinstance(data, dict):
+        data = next((data[key] for key in _JSON_LIST_KEYS if isinstance(data.get(key), list)), [])
+    segments: List[dict] = []
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        text = _first(item, _JSON_TEXT_KEYS)
+        if isinstance(text, list):  # word-level exports: [{"text"|"word": ...}, ...]
+            text = " ".join(str(w.get("text") or w.get("word") or "") if isinstance(w, dict) else str(w) for w in text)
+        text = str(text or "").strip()
+        if not text:
+            continue
+        speaker = _first(item, _JSON_SPEAKER_KEYS)
+        try:
+            start = _json_time(_first(item, _JSON_START_KEYS))
+            end = _json_time(_first(item, _JSON_END_KEYS))
+        except ValueError:
+            continue  # one malformed entry should not turn the whole export into plain text
+        segments.append({
+            "start": start,
+            "end": end,
+            "speaker": str(speaker).strip() if speaker is not None and str(speaker).strip() else None,
+            "text": text,
+        })
+    return segments
+
+# ------------------ PUBLIC API ------------------
+def parse_captions(content: str, filename: Optional[str] = None) -> Optional[List[dict]]:
+    """
+    Parse an SRT, WebVTT or speaker-JSON transcript into segments
+    ({"start", "end", "speaker", "text"}; speaker/times are None when the file has none).
+    Returns None for plain text, so the caller can treat it as an unstructured transcript.
+    """
+    stripped = content.lstrip("﻿").strip()
+    if not stripped:
+        return None
+    extension = (filename or "").rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+
+    if extension == "json" or stripped[0] in "[{":
+        try:
+            segments = _parse_json(json.loads(stripped))
+        except (json.JSONDecodeError, ValueError, TypeError):
+            segments = []
+        return segments or None
+
+    if extension in ("srt", "vtt") or stripped.startswith("WEBVTT") or "-->" in stripped[:1000]:
+        return _parse_cues(stripped) or None
+    return None
+
+def has_speakers(segments: Optional[List[dict]]) -> bool:
+    """True when every segment carries a speaker label, i.e. LLM diarization has nothing to add"""
+    return bool(segments) and all(segment.get("speaker") for segment in segments)
+
+def speaker_turns(segments: List[dict]) -> List[Tuple[str, str]]:
+    """Merge consecutive segments of the same speaker into the [(speaker, text)] shape diarize_async() returns"""
+    turns: List[Tuple[str, str]] = []
+    for segment in segments:
+        speaker = segment.get("speaker") or "Speaker 1"
+        if turns and turns[-1][0] == speaker:
+            turns[-1] = (speaker, f"{turns[-1][1]} {segment['text']}")
+        else:
+            turns.append((speaker, segment["text"]))
+    return turns
+
+def captions_text(segments: List[dict]) -> str:
+    """Plain transcript text of the segments, without timestamps or speaker labels"""
+    return " ".join(segment["text"] for segment in segments)
@@ -0,0 +1,110 @@
+from collections import deque
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Health of one provider/model, shared by every request. Closed: calls go through
+    and their outcomes are recorded; once at least `min_calls` of the last `window`
+    calls are known and `failure_rate` of them failed (errors, or successes slower than
+    `slow_call_seconds`), the breaker opens. Open: callers route around the provider.
+    After `open_seconds` the owner sends one probe (half-open); success closes the
+    breaker, failure opens it for another `open_seconds`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        min_calls: int,
+        failure_rate: float,
+        slow_call_seconds: float,
+        open_seconds: float,
+    ):
+        self.name = name
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=max(1, window))  # True = failed
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self.last_error = None
+        self.times_opened = 0
+        self.skipped = 0
+
+    def _open(self, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.times_opened += 1
+        print(f"⚠️ Circuit for {self.name} opened ({reason}); routing around it for {self.open_seconds:.0f}s")
+
+    @property
+    def available(self) -> bool:
+        return self.state == CLOSED
+
+    def note_skipped(self) -> None:
+        with self._lock:
+            self.skipped += 1
+
+    def probe_due(self) -> bool:
+        """True once per cool-down: the caller should send a probe and record its outcome"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self, seconds: float) -> None:
+        slow = seconds > self.slow_call_seconds
+        with self._lock:
+            if self.state == CLOSED:
+                self._outcomes.append(slow)
+                self._check(f"slow calls ({seconds:.1f}s)")
+            elif self.state == HALF_OPEN and slow:
+                self._open(f"probe took {seconds:.1f}s")
+            elif not slow:
+                # A probe, or a call sent while every provider was open, got through in time
+                self.state = CLOSED
+                print(f"✅ Circuit for {self.name} closed again")
+
+    def record_failure(self, error: Exception, trip: bool = False) -> None:
+        """`trip` opens a closed breaker at once (bad key, quota): retrying soon cannot help"""
+        with self._lock:
+            self.last_error = str(error)[:200]
+            if self.state == HALF_OPEN or (self.state == CLOSED and trip):
+                self._open(self.last_error)
+            elif self.state == CLOSED:
+                self._outcomes.append(True)
+                self._check(self.last_error)
+
+    def _check(self, reason: str) -> None:
+        if len(self._outcomes) < self.min_calls:
+            return
+        failed = sum(self._outcomes)
+        if failed / len(self._outcomes) >= self.failure_rate:
+            self._open(f"{failed}/{len(self._outcomes)} bad calls, last: {reason}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            outcomes = list(self._outcomes)
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+            return {
+                "name": self.name,
+                "state": self.state,
+                "recent_calls": len(outcomes),
+                "recent_failure_rate": round(sum(outcomes) / len(outcomes), 3) if outcomes else 0.0,
+                "times_opened": self.times_opened,
+                "calls_skipped": self.skipped,
+                "probe_in_seconds": retry_in,
+                "last_error": self.last_error,
+            }
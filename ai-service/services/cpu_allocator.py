@@ -0,0 +1,137 @@
+from typing import Dict, List, Optional
+from contextlib import contextmanager
+import os
+import threading
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+from core.config import settings
+
+
+def _available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class CpuAllocator:
+    """
+    Splits the CPU cores between the inference jobs running at the same time.
+
+    The cores are partitioned statically into `slots` equal shares (one per Whisper
+    replica that can run at the same time). A job takes a share of cores no other job
+    is using, so the threads of all running jobs never add up to more than the
+    cores; only a job that finds fewer free cores than `min_threads` (more jobs
+    than slots, e.g. two model sizes busy at once) shares the least loaded ones.
+    The job then sets torch's intra-op thread count to its share, and optionally pins
+    its thread to those cores.
+    """
+
+    def __init__(self, cores: List[int], slots: int = 1, min_threads: int = 1, pin: bool = False):
+        self.cores = cores
+        self.min_threads = max(1, min(min_threads, len(cores)))
+        self.share = max(self.min_threads, len(cores) // max(1, slots))
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        self._lock = threading.Lock()
+        self._load: Dict[int, int] = {core: 0 for core in cores}
+        self._jobs: Dict[int, List[int]] = {}  # thread id -> cores
+        self.jobs_started = 0
+
+    def acquire(self) -> List[int]:
+        with self._lock:
+            free = [core for core in self.cores if self._load[core] == 0]
+            if len(free) >= self.min_threads:
+                chosen = free[:self.share]
+            else:
+                chosen = sorted(self.cores, key=lambda core: (self._load[core], core))[:self.min_threads]
+            for core in chosen:
+                self._load[core] += 1
+            self._jobs[threading.get_ident()] = chosen
+            self.jobs_started += 1
+            return chosen
+
+    def release(self) -> None:
+        with self._lock:
+            for core in self._jobs.pop(threading.get_ident(), []):
+                self._load[core] -= 1
+
+    @contextmanager
+    def job(self):
+        """Run the body with this thread's torch threads (and affinity) limited to its share"""
+        cores = self.acquire()
+        previous_threads = torch.get_num_threads() if torch is not None else None
+        try:
+            if torch is not None:
+                # OpenMP thread count is per calling thread, so concurrent jobs don't clobber each other
+                torch.set_num_threads(len(cores))
+            if self.pin:
+                os.sched_setaffinity(0, cores)  # 0 = the calling thread on Linux
+            yield cores
+        finally:
+            if self.pin:
+                os.sched_setaffinity(0, self.cores)
+            if previous_threads is not None:
+                torch.set_num_threads(previous_threads)
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cores": len(self.cores),
+                "threads_per_slot": self.share,
+                "active_jobs": len(self._jobs),
+                "threads_per_job": [len(cores) for cores in self._jobs.values()],
+                "core_load": [self._load[core] for core in self.cores],
+                "pinning": self.pin,
+                "jobs_started": self.jobs_started,
+            }
+
+
+_allocator: Optional[CpuAllocator] = None
+_allocator_lock = threading.Lock()
+_interop_configured = False
+
+def configure_interop_threads() -> None:
+    """
+    Whisper inference never runs independent ops in parallel; one inter-op thread is enough.
+    torch only accepts this before its first parallel op, so call it at process startup,
+    before any model is loaded.
+    """
+    global _interop_configured
+    if _interop_configured or torch is None:
+        return
+    _interop_configured = True
+    try:
+        torch.set_num_interop_threads(settings.whisper_interop_threads)
+    except RuntimeError as e:
+        print(f"Could not set torch inter-op threads: {e}")
+
+def get_cpu_allocator() -> Optional[CpuAllocator]:
+    global _allocator
+    if _allocator is None and settings.whisper_cpu_allocation:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = CpuAllocator(
+                    _available_cores(),
+                    slots=settings.whisper_pool_size,
+                    min_threads=settings.whisper_min_threads_per_job,
+                    pin=settings.whisper_cpu_pinning,
+                )
+    return _allocator
+
+@contextmanager
+def cpu_job():
+    """Context for one inference call; a no-op when `whisper_cpu_allocation` is off"""
+    allocator = get_cpu_allocator()
+    if allocator is None:
+        yield None
+        return
+    with allocator.job() as cores:
+        yield cores
+
+def get_cpu_stats() -> Optional[dict]:
+    allocator = get_cpu_allocator()
+    return allocator.stats() if allocator else None
@@ -0,0 +1,136 @@
+from typing import Any, List, Optional, Tuple
+import json
+
+_WHITESPACE = " \t\r\n"
+
+
+class _Frame:
+    __slots__ = ("kind", "start", "key", "index", "expect_key", "value_start", "value_done")
+
+    def __init__(self, kind: str, start: int):
+        self.kind = kind  # "{" or "["
+        self.start = start
+        self.key: Optional[str] = None
+        self.index = 0
+        self.expect_key = kind == "{"
+        self.value_start: Optional[int] = None
+        self.value_done = False
+
+
+class JsonStreamParser:
+    """
+    Incremental parser for one JSON document arriving in pieces (LLM token stream).
+    feed() returns every value that completed in the new text and sits at most
+    `max_depth` levels below the root, as (path, value): with the default depth 2,
+    ("title",) once the title string closes and ("action_items", 0) as soon as the
+    first action item object closes, long before the document ends. Text before the
+    root (markdown fences, chatter) and after it is ignored. `complete` tells whether
+    the root has closed, so a stream that ends without it was truncated.
+    """
+
+    def __init__(self, max_depth: int = 2):
+        self.max_depth = max_depth
+        self._text = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self.complete = False
+        self.value: Any = None
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def _path(self) -> Tuple:
+        return tuple(frame.key if frame.kind == "{" else frame.index for frame in self._stack)
+
+    def _emit(self, events: list, start: int, end: int) -> None:
+        """The value text[start:end] of the innermost frame's current slot is complete"""
+        frame = self._stack[-1]
+        frame.value_done = True
+        if len(self._stack) > self.max_depth:
+            return
+        try:
+            value = json.loads(self._text[start:end])
+        except json.JSONDecodeError:
+            return
+        events.append((self._path(), value))
+
+    def _finish_slot(self, events: list, end: int) -> None:
+        """`,` or a closing bracket: a number/literal still pending in the slot is complete"""
+        frame = self._stack[-1]
+        if frame.value_start is not None and not frame.value_done:
+            self._emit(events, frame.value_start, end)
+        frame.value_start = None
+        frame.value_done = False
+
+    def feed(self, chunk: str) -> List[Tuple[Tuple, Any]]:
+        events: List[Tuple[Tuple, Any]] = []
+        if self.complete or not chunk:
+            return events
+        self._text += chunk
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    frame = self._stack[-1]
+                    if frame.kind == "{" and frame.expect_key:
+                        try:
+                            frame.key = json.loads(text[self._string_start:pos + 1])
+                        except json.JSONDecodeError:
+                            frame.key = text[self._string_start + 1:pos]
+                    else:
+                        self._emit(events, self._string_start, pos + 1)
+                continue
+
+            if not self._stack:
+                if char in "{[":
+                    self._stack.append(_Frame(char, pos))
+                continue
+            frame = self._stack[-1]
+
+            if char in _WHITESPACE:
+                continue
+            if char == ":":
+                frame.expect_key = False
+                continue
+            if char == ",":
+                self._finish_slot(events, pos)
+                if frame.kind == "{":
+                    frame.expect_key = True
+                    frame.key = None
+                else:
+                    frame.index += 1
+                continue
+            if char in "}]":
+                self._finish_slot(events, pos)
+                closed = self._stack.pop()
+                if not self._stack:
+                    self.complete = True
+                    try:
+                        self.value = json.loads(text[closed.start:pos + 1])
+                    except json.JSONDecodeError:
+                        self.value = None
+                    self._pos = pos + 1
+                    return events
+                self._emit(events, closed.start, pos + 1)
+                continue
+
+            # Start of a value (or of a key string)
+            if not (frame.kind == "{" and frame.expect_key) and frame.value_start is None:
+                frame.value_start = pos
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in "{[":
+                self._stack.append(_Frame(char, pos))
+        self._pos = len(text)
+        return events
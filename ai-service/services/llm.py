@@ -0,0 +1,932 @@
+from typing import AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import os
+import threading
+import time
+
+try:
+    from openai import OpenAI, AsyncOpenAI
+    from openai import AuthenticationError, PermissionDeniedError, APIError
+except ImportError:
+    OpenAI = None
+    AsyncOpenAI = None
+    AuthenticationError = None
+    PermissionDeniedError = None
+    APIError = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+from core.config import settings
+from services.llm_cache import LlmCache, make_llm_cache_key
+from services.circuit_breaker import CircuitBreaker, OPEN
+
+# Tried in order before asking the API which models exist; newer, faster models first
+_GEMINI_MODELS = [
+    'gemini-2.5-flash',
+    'gemini-2.0-flash',
+    'gemini-1.5-flash-latest',
+    'gemini-1.5-flash',
+    'gemini-1.5-flash-8b',
+    'gemini-pro',
+    'gemini-1.0-pro',
+]
+
+# Meeting transcripts trip the default filters surprisingly often
+_GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+_AUTH_KEYWORDS = [
+    "api key", "authentication", "invalid", "expired", "unauthorized",
+    "permission denied", "insufficient_quota", "quota",
+]
+
+# Errors without an HTTP status (missing key, SDK configuration) that open a provider's
+# circuit at once instead of counting towards its error rate; API errors go by status code
+_TRIP_KEYWORDS = [
+    "api key", "api_key", "authentication", "unauthorized", "permission denied", "insufficient_quota",
+]
+
+# One client per provider, shared by every service
+_openai_client = None
+_async_openai_client = None
+_gemini_client = None  # Resolved GenerativeModel, kept until it 404s
+_gemini_api_key: Optional[str] = None
+_gemini_listed: Optional[Dict[str, dict]] = None  # name -> capabilities, from list_models
+_gemini_listed_at = 0.0
+_gemini_refresher: Optional[threading.Thread] = None
+_client_lock = threading.Lock()
+_slots: Dict[str, threading.BoundedSemaphore] = {}
+_async_slots: Dict[str, asyncio.Semaphore] = {}
+_llm_cache: Optional[LlmCache] = None
+_breakers: Dict[tuple, CircuitBreaker] = {}  # (provider, model) -> breaker
+_breaker_prober: Optional[threading.Thread] = None
+# Async calls in progress by (system, prompt, temperature, max_tokens): identical concurrent calls share one
+_async_flights: Dict[tuple, asyncio.Future] = {}
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {
+    provider: {"calls": 0, "errors": 0, "seconds": 0.0} for provider in ("openai", "gemini")
+}
+_fallbacks = 0
+_coalesced = 0
+
+
+class GeminiBlocked(RuntimeError):
+    """Gemini returned no content (safety filters)"""
+
+
+class _Completion(str):
+    """Completion text that remembers whether the model stopped at max_tokens"""
+    truncated = False
+
+
+def _completion(text: str, truncated: bool) -> str:
+    completion = _Completion(text)
+    completion.truncated = truncated
+    return completion
+
+def _gemini_truncated(candidate) -> bool:
+    reason = getattr(candidate, "finish_reason", None)
+    return getattr(reason, "name", reason) in ("MAX_TOKENS", 2)
+
+
+# ------------------ OPENAI CLIENT ------------------
+def _openai_api_key() -> Optional[str]:
+    return settings.openai_api_key or os.getenv("OPENAI_API_KEY")
+
+def _get_openai_client():
+    """One OpenAI client for the process, with a pooled keep-alive HTTP client"""
+    global _openai_client
+    if _openai_client is None:
+        if OpenAI is None:
+            raise ImportError("Install OpenAI with: pip install openai")
+        api_key = _openai_api_key()
+        if not api_key:
+            raise ValueError("Missing OPENAI_API_KEY in .env or environment.")
+        with _client_lock:
+            if _openai_client is None:
+                kwargs = {}
+                if httpx is not None:
+                    kwargs["http_client"] = httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=settings.llm_max_connections,
+                            max_keepalive_connections=settings.llm_max_connections,
+                        ),
+                        timeout=settings.llm_timeout_seconds,
+                    )
+                _openai_client = OpenAI(
+                    api_key=api_key,
+                    timeout=settings.llm_timeout_seconds,
+                    max_retries=settings.llm_max_retries,
+                    **kwargs,
+                )
+                print("✅ OpenAI client initialized.")
+    return _openai_client
+
+def _get_async_openai_client():
+    """AsyncOpenAI twin of _get_openai_client, for calls awaited on the event loop"""
+    global _async_openai_client
+    if _async_openai_client is None:
+        if AsyncOpenAI is None:
+            raise ImportError("Install OpenAI with: pip install openai")
+        api_key = _openai_api_key()
+        if not api_key:
+            raise ValueError("Missing OPENAI_API_KEY in .env or environment.")
+        kwargs = {}
+        if httpx is not None:
+            kwargs["http_client"] = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.llm_max_async_concurrency,
+                    max_keepalive_connections=settings.llm_max_connections,
+                ),
+                timeout=settings.llm_timeout_seconds,
+            )
+        _async_openai_client = AsyncOpenAI(
+            api_key=api_key,
+            timeout=settings.llm_timeout_seconds,
+            max_retries=settings.llm_max_retries,
+            **kwargs,
+        )
+    return _async_openai_client
+
+# ------------------ GEMINI CLIENT ------------------
+def _configure_gemini_api_key() -> str:
+    """Configure the Gemini SDK once; the environment is only searched until a key is found"""
+    global _gemini_api_key
+    if genai is None:
+        raise ImportError("Install Google Generative AI with: pip install google-generativeai")
+    api_key = settings.google_api_key or _gemini_api_key or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        for key, value in os.environ.items():
+            if key.upper() == "GOOGLE_API_KEY":
+                api_key = value
+                break
+    if not api_key:
+        raise ValueError(
+            "Missing GOOGLE_API_KEY. Please set it in:\n"
+            "1. .env file: GOOGLE_API_KEY=your_key\n"
+            "2. Environment variable: export GOOGLE_API_KEY=your_key (Linux/Mac) or set GOOGLE_API_KEY=your_key (Windows)"
+        )
+    if api_key != _gemini_api_key:
+        genai.configure(api_key=api_key)
+        _gemini_api_key = api_key
+    return api_key
+
+def _list_gemini_models(force: bool = False) -> Dict[str, dict]:
+    """
+    Models the key can use for generateContent with their token limits, cached for
+    `llm_gemini_model_ttl_seconds` (the background refresher renews it). Empty if listing fails.
+    """
+    global _gemini_listed, _gemini_listed_at
+    fresh = time.monotonic() - _gemini_listed_at < settings.llm_gemini_model_ttl_seconds
+    if _gemini_listed is not None and fresh and not force:
+        return _gemini_listed
+    try:
+        listed = {
+            model.name.replace('models/', ''): {
+                "input_token_limit": getattr(model, "input_token_limit", None),
+                "output_token_limit": getattr(model, "output_token_limit", None),
+            }
+            for model in genai.list_models()
+            if 'generateContent' in model.supported_generation_methods
+        }
+    except Exception as e:
+        print(f"⚠️ Could not list Gemini models: {e}")
+        return _gemini_listed or {}
+    _gemini_listed, _gemini_listed_at = listed, time.monotonic()
+    return listed
+
+def _preferred_gemini_model(listed: Dict[str, dict], exclude: Optional[str] = None) -> Optional[str]:
+    """First of _GEMINI_MODELS the key can use, else any model it can use"""
+    for name in [*_GEMINI_MODELS, *listed]:
+        if name in listed and name != exclude:
+            return name
+    return None
+
+def _resolve_gemini_model(exclude: Optional[str] = None, force: bool = False):
+    """Pick the model from the (cached) model list without spending a generation on it"""
+    global _gemini_client
+    name = _preferred_gemini_model(_list_gemini_models(force), exclude)
+    if name is None:
+        return None
+    model = genai.GenerativeModel(name)
+    with _client_lock:
+        _gemini_client = model
+    print(f"✅ Using Gemini model: {name}")
+    return model
+
+def _refresh_gemini_models() -> None:
+    """Background loop: renew the model list every TTL and move to a better or still-existing model"""
+    while True:
+        time.sleep(max(60.0, settings.llm_gemini_model_ttl_seconds))
+        try:
+            _configure_gemini_api_key()
+            listed = _list_gemini_models(force=True)
+            current = getattr(_gemini_client, "model_name", "").replace('models/', '')
+            if listed and _preferred_gemini_model(listed) != current:
+                _resolve_gemini_model()
+        except Exception as e:
+            print(f"⚠️ Gemini model refresh failed: {e}")
+
+def start_gemini_refresher() -> None:
+    """Resolve the Gemini model now and keep it current, so a fallback never waits on list_models"""
+    global _gemini_refresher
+    if _gemini_refresher is not None or genai is None:
+        return
+    with _client_lock:
+        if _gemini_refresher is not None:
+            return
+        _gemini_refresher = threading.Thread(target=_refresh_gemini_models, daemon=True)
+    try:
+        _configure_gemini_api_key()
+        if _gemini_client is None:
+            _resolve_gemini_model()
+    except Exception as e:
+        print(f"⚠️ Gemini not available yet: {e}")
+    _gemini_refresher.start()
+
+def _gemini_options(model, max_tokens: int, temperature: float) -> dict:
+    limit = (_gemini_listed or {}).get(model.model_name.replace('models/', ''), {}).get("output_token_limit")
+    return {
+        "generation_config": genai.types.GenerationConfig(
+            temperature=temperature,
+            max_output_tokens=min(max_tokens, limit) if limit else max_tokens,
+        ),
+        "safety_settings": _GEMINI_SAFETY_SETTINGS,
+    }
+
+def _gemini_text(response) -> str:
+    if not response.candidates or not response.candidates[0].content.parts:
+        raise GeminiBlocked(f"Response blocked by safety filters: {response.prompt_feedback}")
+    return _completion(response.text.strip(), _gemini_truncated(response.candidates[0]))
+
+def _gemini_generate(model, prompt: str, max_tokens: int, temperature: float) -> str:
+    return _gemini_text(model.generate_content(prompt, **_gemini_options(model, max_tokens, temperature)))
+
+def _is_not_found(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return "404" in error_str or "not found" in error_str
+
+def _is_gemini_auth_error(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return any(k in error_str for k in ("api key", "api_key", "authentication", "401", "403"))
+
+def _gemini_error(error: Exception) -> Exception:
+    if _is_gemini_auth_error(error):
+        return ValueError(f"Gemini API key error: {error}")
+    return RuntimeError(f"Gemini API error: {error}")
+
+def _gemini_model():
+    """Configured SDK and the resolved model (None if the model list is unavailable)"""
+    try:
+        _configure_gemini_api_key()
+    except ValueError as key_error:
+        raise RuntimeError(f"Gemini API key not configured: {key_error}")
+    start_gemini_refresher()
+    return _gemini_client or _resolve_gemini_model()
+
+def _replace_gemini_model(model):
+    """The model 404'd: forget it and resolve the next usable one from a fresh model list"""
+    global _gemini_client
+    print(f"⚠️ Gemini model {model.model_name} not found, resolving another one...")
+    with _client_lock:
+        if _gemini_client is model:
+            _gemini_client = None
+    return _resolve_gemini_model(exclude=model.model_name.replace('models/', ''), force=True)
+
+def _probe_gemini_models(prompt: str, max_tokens: int, temperature: float, tried: set, last_error) -> str:
+    """Last resort when the model list is unavailable: try the known model names one by one"""
+    global _gemini_client
+    for model_name in _GEMINI_MODELS:
+        if model_name in tried or f"models/{model_name}" in tried:
+            continue
+        try:
+            model = genai.GenerativeModel(model_name)
+            text = _gemini_generate(model, prompt, max_tokens, temperature)
+        except GeminiBlocked as e:
+            last_error = e
+            continue
+        except Exception as e:
+            if _is_gemini_auth_error(e) and not _is_not_found(e):
+                raise ValueError(f"Gemini API key error: {e}")
+            last_error = e
+            continue
+        with _client_lock:
+            _gemini_client = model
+        print(f"✅ Using Gemini model: {model_name}")
+        return text
+
+    raise RuntimeError(
+        f"Gemini API error: All models failed. Last error: {last_error}. "
+        f"Please check your GOOGLE_API_KEY and available models."
+    )
+
+def _generate_with_gemini(prompt: str, max_tokens: int, temperature: float) -> str:
+    """
+    Generate with the resolved Gemini model. Only a 404 drops it: the model list is then
+    fetched again and the next usable model is resolved. If listing is unavailable the
+    known model names are tried one by one.
+    """
+    model = _gemini_model()
+    tried, last_error = set(), None
+    while model is not None and model.model_name not in tried:
+        tried.add(model.model_name)
+        try:
+            return _gemini_generate(model, prompt, max_tokens, temperature)
+        except Exception as e:
+            if not _is_not_found(e):
+                raise _gemini_error(e)
+            last_error = e
+            model = _replace_gemini_model(model)
+    return _probe_gemini_models(prompt, max_tokens, temperature, tried, last_error)
+
+async def _generate_with_gemini_async(prompt: str, max_tokens: int, temperature: float) -> str:
+    """_generate_with_gemini on the event loop; only (re)resolving the model uses a thread"""
+    model = _gemini_client if _gemini_refresher is not None else None
+    if model is None:
+        model = await asyncio.to_thread(_gemini_model)
+    tried, last_error = set(), None
+    while model is not None and model.model_name not in tried:
+        tried.add(model.model_name)
+        try:
+            response = await model.generate_content_async(prompt, **_gemini_options(model, max_tokens, temperature))
+            return _gemini_text(response)
+        except Exception as e:
+            if not _is_not_found(e):
+                raise _gemini_error(e)
+            last_error = e
+            model = await asyncio.to_thread(_replace_gemini_model, model)
+    return await asyncio.to_thread(_probe_gemini_models, prompt, max_tokens, temperature, tried, last_error)
+
+# ------------------ GATEWAY ------------------
+def _slot(provider: str) -> threading.BoundedSemaphore:
+    if provider not in _slots:
+        with _client_lock:
+            _slots.setdefault(provider, threading.BoundedSemaphore(max(1, settings.llm_max_concurrency)))
+    return _slots[provider]
+
+def _async_slot(provider: str) -> asyncio.Semaphore:
+    """Event-loop side limit; much higher than the thread one since a waiting call costs no thread"""
+    if provider not in _async_slots:
+        _async_slots[provider] = asyncio.Semaphore(max(1, settings.llm_max_async_concurrency))
+    return _async_slots[provider]
+
+def _record(provider: str, started: float, failed: bool) -> None:
+    with _stats_lock:
+        stats = _stats[provider]
+        stats["calls"] += 1
+        stats["errors"] += int(failed)
+        stats["seconds"] += time.perf_counter() - started
+
+def _call(provider: str, fn, *args) -> str:
+    """_call_once, retrying rate-limited (429) calls with backoff"""
+    attempt = 0
+    while True:
+        try:
+            return _call_once(provider, fn, *args)
+        except Exception as e:
+            delay = _rate_limit_delay(provider, e, attempt)
+            if delay is None:
+                raise
+        time.sleep(delay)
+        attempt += 1
+
+async def _acall(provider: str, fn, *args) -> str:
+    attempt = 0
+    while True:
+        try:
+            return await _acall_once(provider, fn, *args)
+        except Exception as e:
+            delay = _rate_limit_delay(provider, e, attempt)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+        attempt += 1
+
+def _call_once(provider: str, fn, *args) -> str:
+    """Run one provider call under its concurrency limit and count it"""
+    breaker = _breaker(provider)
+    with _slot(provider):
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            _record(provider, started, failed=True)
+            _record_health(breaker, e, time.perf_counter() - started)
+            raise
+        _record(provider, started, failed=False)
+        breaker.record_success(time.perf_counter() - started)
+        return result
+
+async def _acall_once(provider: str, fn, *args) -> str:
+    breaker = _breaker(provider)
+    async with _async_slot(provider):
+        started = time.perf_counter()
+        try:
+            result = await fn(*args)
+        except Exception as e:
+            _record(provider, started, failed=True)
+            _record_health(breaker, e, time.perf_counter() - started)
+            raise
+        _record(provider, started, failed=False)
+        breaker.record_success(time.perf_counter() - started)
+        return result
+
+def _openai_messages(prompt: str, system: str) -> List[dict]:
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    return messages
+
+def _openai_complete(prompt: str, system: str, max_tokens: int, temperature: float) -> str:
+    completion = _get_openai_client().chat.completions.create(
+        model=settings.llm_openai_model,
+        messages=_openai_messages(prompt, system),
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    choice = completion.choices[0]
+    return _completion(choice.message.content.strip(), choice.finish_reason == "length")
+
+async def _openai_complete_async(prompt: str, system: str, max_tokens: int, temperature: float) -> str:
+    completion = await _get_async_openai_client().chat.completions.create(
+        model=settings.llm_openai_model,
+        messages=_openai_messages(prompt, system),
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    choice = completion.choices[0]
+    return _completion(choice.message.content.strip(), choice.finish_reason == "length")
+
+def _should_fall_back(error: Exception) -> bool:
+    """OpenAI errors worth retrying on Gemini: bad/expired key, quota, rate limit, any API error"""
+    if isinstance(error, ValueError) and "Missing OPENAI_API_KEY" in str(error):
+        return True
+    if any(cls is not None and isinstance(error, cls) for cls in (AuthenticationError, PermissionDeniedError, APIError)):
+        return True
+    if _status_code(error) in (401, 403, 429):
+        return True
+    error_str = str(error).lower()
+    return any(k in error_str for k in _AUTH_KEYWORDS)
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP status of an SDK error: `status_code` (OpenAI) or an integer `code` (google.api_core)"""
+    for attribute in ("status_code", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+def _quota_exhausted(error: Exception) -> bool:
+    """OpenAI reports an empty balance as a 429 too, but it does not clear by waiting"""
+    return getattr(error, "code", None) == "insufficient_quota" or "insufficient_quota" in str(error)
+
+def _is_rate_limited(error: Exception) -> bool:
+    return _status_code(error) == 429 and not _quota_exhausted(error)
+
+def _rate_limit_delay(provider: str, error: Exception, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying a rate-limited call, None once `llm_rate_limit_retries` are used up"""
+    if not _is_rate_limited(error) or attempt >= settings.llm_rate_limit_retries:
+        return None
+    delay = settings.llm_rate_limit_backoff_seconds * 2 ** attempt
+    print(f"⚠️ {provider} rate limited, retrying in {delay:.1f}s ({attempt + 1}/{settings.llm_rate_limit_retries})")
+    return delay
+
+# ------------------ CIRCUIT BREAKERS ------------------
+def _breaker(provider: str) -> CircuitBreaker:
+    """Shared breaker of the provider's current model"""
+    key = (provider, _provider_model(provider) or "auto")
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _client_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(
+                f"{provider}:{key[1]}",
+                window=settings.llm_breaker_window,
+                min_calls=settings.llm_breaker_min_calls,
+                failure_rate=settings.llm_breaker_failure_rate,
+                slow_call_seconds=settings.llm_breaker_slow_call_seconds,
+                open_seconds=settings.llm_breaker_open_seconds,
+            ))
+    return breaker
+
+def _is_health_failure(error: Exception) -> bool:
+    """
+    False for errors about the request itself (blocked content, 400s) and for rate limits:
+    the provider is up, and a short burst of 429s is backed off and retried, not an outage
+    """
+    if isinstance(error, GeminiBlocked) or "blocked by safety filters" in str(error):
+        return False
+    if _quota_exhausted(error):
+        return True
+    status = _status_code(error)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in (401, 403, 408))
+
+def _is_trip_error(error: Exception) -> bool:
+    if any(cls is not None and isinstance(error, cls) for cls in (AuthenticationError, PermissionDeniedError)):
+        return True
+    status = _status_code(error)
+    if status in (401, 403) or _quota_exhausted(error):
+        return True
+    if status is not None:
+        return False
+    error_str = str(error).lower()
+    return any(k in error_str for k in _TRIP_KEYWORDS)
+
+def _record_health(breaker: CircuitBreaker, error: Exception, seconds: float) -> None:
+    if not _is_health_failure(error):
+        breaker.record_success(seconds)
+        return
+    breaker.record_failure(error, trip=_is_trip_error(error))
+    if breaker.state == OPEN:
+        start_breaker_prober()
+
+def _gemini_usable() -> bool:
+    """The SDK is installed and a key is configured (no network call)"""
+    try:
+        _configure_gemini_api_key()
+    except (ImportError, ValueError):
+        return False
+    return True
+
+def _use_openai(client_cls) -> bool:
+    """
+    OpenAI goes first unless its circuit is open while Gemini's is closed and Gemini
+    can actually be called; with nowhere to go, OpenAI keeps getting the calls.
+    """
+    if client_cls is None or not _openai_api_key():
+        return False
+    openai = _breaker("openai")
+    if openai.available or not _breaker("gemini").available or not _gemini_usable():
+        return True
+    openai.note_skipped()
+    return False
+
+def _probe(provider: str, model: str) -> None:
+    """Smallest possible request to an open provider/model"""
+    if provider == "openai":
+        _openai_complete("ping", "", 1, 0.0)
+    elif model == "auto":
+        _generate_with_gemini("ping", 5, 0.0)
+    else:
+        _configure_gemini_api_key()
+        _gemini_generate(genai.GenerativeModel(model), "ping", 5, 0.0)
+
+def _probe_open_breakers() -> None:
+    """Background loop: once an open circuit has cooled down, probe it and close it on success"""
+    while True:
+        time.sleep(max(1.0, min(5.0, settings.llm_breaker_open_seconds / 4)))
+        for (provider, model), breaker in list(_breakers.items()):
+            if not breaker.probe_due():
+                continue
+            started = time.perf_counter()
+            try:
+                _probe(provider, model)
+            except Exception as e:
+                _record_health(breaker, e, time.perf_counter() - started)
+                continue
+            breaker.record_success(time.perf_counter() - started)
+
+def start_breaker_prober() -> None:
+    global _breaker_prober
+    if _breaker_prober is not None:
+        return
+    with _client_lock:
+        if _breaker_prober is not None:
+            return
+        _breaker_prober = threading.Thread(target=_probe_open_breakers, daemon=True)
+    _breaker_prober.start()
+
+def get_breaker_states() -> List[dict]:
+    return [breaker.snapshot() for breaker in list(_breakers.values())]
+
+def _count_coalesced() -> None:
+    global _coalesced
+    with _stats_lock:
+        _coalesced += 1
+
+def _count_fallback(error: Exception) -> None:
+    global _fallbacks
+    print(f"⚠️ OpenAI API error ({error}). Falling back to Gemini...")
+    with _stats_lock:
+        _fallbacks += 1
+
+# ------------------ RESPONSE CACHE ------------------
+def _get_llm_cache() -> Optional[LlmCache]:
+    global _llm_cache
+    if _llm_cache is None and settings.llm_cache_enabled:
+        with _client_lock:
+            if _llm_cache is None:
+                _llm_cache = LlmCache(
+                    settings.llm_cache_path,
+                    max_bytes=settings.llm_cache_max_mb * 1024 * 1024,
+                    memory_entries=settings.llm_cache_memory_entries,
+                    ttl_seconds=settings.llm_cache_ttl_seconds,
+                )
+    return _llm_cache
+
+def _provider_model(provider: str) -> Optional[str]:
+    if provider == "openai":
+        return settings.llm_openai_model
+    current = _gemini_client
+    return current.model_name.replace('models/', '') if current is not None else None
+
+def _cache_keys(prompt: str, system: str, max_tokens: int, temperature: float) -> List[str]:
+    """Keys of the providers that could answer right now, in the order they would be asked"""
+    providers = ["openai"] if _openai_api_key() else []
+    providers.append("gemini")
+    keys = []
+    for provider in providers:
+        model = _provider_model(provider)
+        if model is not None:
+            keys.append(make_llm_cache_key(provider, model, system, prompt, temperature, max_tokens))
+    return keys
+
+def _cacheable(text: str, accept: Optional[Callable[[str], bool]]) -> bool:
+    """
+    Only completions the calling stage can use are cached: a reply cut off at max_tokens,
+    or one `accept` rejects (invalid JSON, ...), would otherwise be served again to the
+    stage's own retry and to every later request with the same prompt.
+    """
+    if not text or getattr(text, "truncated", False):
+        return False
+    if accept is None:
+        return True
+    try:
+        return bool(accept(text))
+    except Exception:
+        return False
+
+def _cached(cache: LlmCache, keys: List[str], accept: Optional[Callable[[str], bool]], memory_only: bool = False) -> Optional[str]:
+    cached = cache.get(*keys, memory_only=memory_only)
+    if cached is not None and accept is not None and not _cacheable(cached, accept):
+        return None  # cached before the stage checked it; the fresh answer replaces it
+    return cached
+
+def _cache_put(provider: str, prompt: str, system: str, max_tokens: int, temperature: float, text: str) -> None:
+    cache = _get_llm_cache()
+    model = _provider_model(provider)
+    if cache is None or model is None or not text:
+        return
+    cache.put(make_llm_cache_key(provider, model, system, prompt, temperature, max_tokens), str(text))
+
+# ------------------ PUBLIC API ------------------
+def _generate_uncached(prompt: str, system: str, max_tokens: int, temperature: float):
+    """Returns (provider that answered, text)"""
+    if _use_openai(OpenAI):
+        try:
+            return "openai", _call("openai", _openai_complete, prompt, system, max_tokens, temperature)
+        except Exception as e:
+            if not _should_fall_back(e):
+                raise
+            _count_fallback(e)
+
+    gemini_prompt = f"{system}\n\n{prompt}" if system else prompt
+    try:
+        return "gemini", _call("gemini", _generate_with_gemini, gemini_prompt, max_tokens, temperature)
+    except Exception as e:
+        print(f"⚠️ Gemini failed: {e}")
+        raise RuntimeError(f"Gemini API failed: {e}")
+
+async def _agenerate_uncached(prompt: str, system: str, max_tokens: int, temperature: float):
+    if _use_openai(AsyncOpenAI):
+        try:
+            return "openai", await _acall("openai", _openai_complete_async, prompt, system, max_tokens, temperature)
+        except Exception as e:
+            if not _should_fall_back(e):
+                raise
+            _count_fallback(e)
+
+    gemini_prompt = f"{system}\n\n{prompt}" if system else prompt
+    try:
+        return "gemini", await _acall("gemini", _generate_with_gemini_async, gemini_prompt, max_tokens, temperature)
+    except Exception as e:
+        print(f"⚠️ Gemini failed: {e}")
+        raise RuntimeError(f"Gemini API failed: {e}")
+
+def generate(
+    prompt: str,
+    system: str = "",
+    max_tokens: int = 2048,
+    temperature: Optional[float] = None,
+    accept: Optional[Callable[[str], bool]] = None,
+) -> str:
+    """
+    Single entry point for text generation: OpenAI (`llm_openai_model`) first, Gemini when
+    OpenAI is not configured or fails with an auth/quota/API error. `system` is sent as the
+    system message to OpenAI and prepended to the prompt for Gemini. While OpenAI's circuit
+    is open (see CircuitBreaker) calls go straight to Gemini. Completions are cached
+    by (provider, model, prompt, system, temperature, max_tokens), so repeated work is free;
+    replies cut off at max_tokens are not cached, and with `accept` (the stage's own check,
+    e.g. "parses as JSON") neither are replies it rejects, so a retry gets a fresh answer.
+    The service itself uses agenerate(); this blocking form is for scripts and threads.
+    """
+    temperature = settings.llm_temperature if temperature is None else temperature
+    cache = _get_llm_cache()
+    if cache is not None:
+        cached = _cached(cache, _cache_keys(prompt, system, max_tokens, temperature), accept)
+        if cached is not None:
+            return cached
+
+    provider, text = _generate_uncached(prompt, system, max_tokens, temperature)
+    if cache is not None and _cacheable(text, accept):
+        _cache_put(provider, prompt, system, max_tokens, temperature, text)
+    return text
+
+async def agenerate(
+    prompt: str,
+    system: str = "",
+    max_tokens: int = 2048,
+    temperature: Optional[float] = None,
+    accept: Optional[Callable[[str], bool]] = None,
+) -> str:
+    """
+    generate() with native async clients (AsyncOpenAI, generate_content_async): waiting
+    costs no thread. Identical calls already in flight are joined instead of sent again.
+    """
+    temperature = settings.llm_temperature if temperature is None else temperature
+    cache = _get_llm_cache()
+    if cache is not None:
+        keys = _cache_keys(prompt, system, max_tokens, temperature)
+        cached = _cached(cache, keys, accept, memory_only=True)
+        if cached is None:
+            cached = await asyncio.to_thread(_cached, cache, keys, accept)
+        if cached is not None:
+            return cached
+
+    key = (system, prompt, temperature, max_tokens)
+    flight = _async_flights.get(key)
+    if flight is not None:
+        _count_coalesced()
+    else:
+        # Own task, so a caller that goes away (client disconnect) does not cancel it for the others
+        flight = asyncio.ensure_future(_agenerate_and_cache(cache, prompt, system, max_tokens, temperature, accept))
+        _async_flights[key] = flight
+        flight.add_done_callback(lambda _: _async_flights.pop(key, None))
+    return await asyncio.shield(flight)
+
+async def _agenerate_and_cache(
+    cache: Optional[LlmCache], prompt: str, system: str, max_tokens: int, temperature: float, accept
+) -> str:
+    provider, text = await _agenerate_uncached(prompt, system, max_tokens, temperature)
+    if cache is not None and _cacheable(text, accept):
+        await asyncio.to_thread(_cache_put, provider, prompt, system, max_tokens, temperature, text)
+    return text
+
+# ------------------ STREAMING ------------------
+async def _openai_stream(prompt: str, system: str, max_tokens: int, temperature: float, finish: dict) -> AsyncIterator[str]:
+    """Text pieces; finish["truncated"] is set when the model stops at max_tokens"""
+    stream = await _get_async_openai_client().chat.completions.create(
+        model=settings.llm_openai_model,
+        messages=_openai_messages(prompt, system),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        if chunk.choices[0].finish_reason == "length":
+            finish["truncated"] = True
+        if chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def _gemini_stream(prompt: str, max_tokens: int, temperature: float, finish: dict) -> AsyncIterator[str]:
+    """
+    Stream from the resolved Gemini model. A 404 before the first piece goes through
+    _generate_with_gemini_async (which resolves another model) and arrives as one piece.
+    """
+    model = _gemini_client if _gemini_refresher is not None else None
+    if model is None:
+        model = await asyncio.to_thread(_gemini_model)
+    if model is None:
+        text = await _generate_with_gemini_async(prompt, max_tokens, temperature)
+        finish["truncated"] = getattr(text, "truncated", False)
+        yield text
+        return
+
+    streamed = False
+    try:
+        response = await model.generate_content_async(
+            prompt, stream=True, **_gemini_options(model, max_tokens, temperature)
+        )
+        async for chunk in response:
+            if chunk.candidates and _gemini_truncated(chunk.candidates[0]):
+                finish["truncated"] = True
+            if chunk.candidates and chunk.candidates[0].content.parts:
+                streamed = True
+                yield chunk.text
+        if not streamed:
+            raise GeminiBlocked(f"Response blocked by safety filters: {response.prompt_feedback}")
+    except Exception as e:
+        if streamed or not _is_not_found(e):
+            raise _gemini_error(e)
+        await asyncio.to_thread(_replace_gemini_model, model)
+        text = await _generate_with_gemini_async(prompt, max_tokens, temperature)
+        finish["truncated"] = getattr(text, "truncated", False)
+        yield text
+
+async def _astream_call(provider: str, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """_acall for streams; the breaker judges latency by the time to the first piece"""
+    breaker = _breaker(provider)
+    async with _async_slot(provider):
+        started = time.perf_counter()
+        first = None
+        try:
+            async for piece in stream:
+                if first is None:
+                    first = time.perf_counter() - started
+                yield piece
+        except Exception as e:
+            _record(provider, started, failed=True)
+            _record_health(breaker, e, time.perf_counter() - started)
+            raise
+        _record(provider, started, failed=False)
+        breaker.record_success(first if first is not None else time.perf_counter() - started)
+
+async def astream(
+    prompt: str,
+    system: str = "",
+    max_tokens: int = 2048,
+    temperature: Optional[float] = None,
+    accept: Optional[Callable[[str], bool]] = None,
+) -> AsyncIterator[str]:
+    """
+    agenerate() as a stream of text pieces, so callers can use the start of a long answer
+    while the rest is being generated. Falls back to Gemini only before the first piece;
+    a cached completion arrives as a single piece. Streams are not coalesced. The whole
+    answer is cached only when the stream was not cut off at max_tokens and `accept` takes it.
+    """
+    temperature = settings.llm_temperature if temperature is None else temperature
+    cache = _get_llm_cache()
+    if cache is not None:
+        keys = _cache_keys(prompt, system, max_tokens, temperature)
+        cached = _cached(cache, keys, accept, memory_only=True)
+        if cached is None:
+            cached = await asyncio.to_thread(_cached, cache, keys, accept)
+        if cached is not None:
+            yield cached
+            return
+
+    pieces: List[str] = []
+    finish = {"truncated": False}
+    provider = "gemini"
+    if _use_openai(AsyncOpenAI):
+        provider = "openai"
+        try:
+            async for piece in _astream_call("openai", _openai_stream(prompt, system, max_tokens, temperature, finish)):
+                pieces.append(piece)
+                yield piece
+        except Exception as e:
+            if pieces or not _should_fall_back(e):
+                raise
+            _count_fallback(e)
+            provider = "gemini"
+
+    if provider == "gemini":
+        gemini_prompt = f"{system}\n\n{prompt}" if system else prompt
+        try:
+            async for piece in _astream_call("gemini", _gemini_stream(gemini_prompt, max_tokens, temperature, finish)):
+                pieces.append(piece)
+                yield piece
+        except Exception as e:
+            print(f"⚠️ Gemini failed: {e}")
+            raise RuntimeError(f"Gemini API failed: {e}")
+
+    text = _completion("".join(pieces).strip(), finish["truncated"])
+    if cache is not None and _cacheable(text, accept):
+        await asyncio.to_thread(_cache_put, provider, prompt, system, max_tokens, temperature, text)
+
+def get_llm_stats() -> dict:
+    with _stats_lock:
+        providers = {
+            provider: {
+                "calls": int(stats["calls"]),
+                "errors": int(stats["errors"]),
+                "avg_seconds": round(stats["seconds"] / stats["calls"], 3) if stats["calls"] else None,
+            }
+            for provider, stats in _stats.items()
+        }
+        fallbacks = _fallbacks
+        coalesced = _coalesced
+    current = _gemini_client
+    return {
+        "providers": providers,
+        "fallbacks": fallbacks,
+        "coalesced": coalesced,
+        "openai_model": settings.llm_openai_model,
+        "gemini_model": getattr(current, "model_name", None) if current is not None else None,
+        "gemini_models_listed": len(_gemini_listed) if _gemini_listed is not None else None,
+        "cache": _llm_cache.stats() if _llm_cache is not None else None,
+    }
@@ -0,0 +1,160 @@
+from typing import Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_llm_cache_key(
+    provider: str, model: str, system: str, prompt: str, temperature: float, max_tokens: int
+) -> str:
+    """Key = hash of everything that changes the completion"""
+    payload = json.dumps(
+        {
+            "provider": provider,
+            "model": model,
+            "system": system,
+            "prompt": prompt,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LlmCache:
+    """
+    Two-tier cache of LLM completions. An in-memory LRU of `memory_entries` answers
+    repeats without touching disk; behind it one SQLite file keeps completions across
+    restarts and workers, bounded by `max_bytes` (least recently used rows go first).
+    Entries older than `ttl_seconds` count as misses and are dropped.
+    """
+
+    def __init__(self, path: str, max_bytes: int, memory_entries: int, ttl_seconds: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (text, created), oldest first
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_used ON completions (used)")
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+
+    def _remember(self, key: str, text: str, created: float) -> None:
+        self._memory[key] = (text, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, *keys: str, memory_only: bool = False) -> Optional[str]:
+        """
+        Completion cached under the first of `keys` that has one, else None (one miss).
+        With `memory_only` a miss is not counted, so the event loop can check the
+        memory tier inline and leave SQLite to a thread.
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is None:
+                    continue
+                if self._expired(entry[1], now):
+                    del self._memory[key]
+                    continue
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+            if memory_only:
+                return None
+
+            for key in keys:
+                try:
+                    row = self._db.execute("SELECT text, size, created FROM completions WHERE key = ?", (key,)).fetchone()
+                    if row is not None and self._expired(row[2], now):
+                        self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                        self._total_bytes -= row[1]
+                        row = None
+                    if row is not None:
+                        self._db.execute("UPDATE completions SET used = ? WHERE key = ?", (now, key))
+                except sqlite3.Error as e:
+                    print(f"LLM cache read failed: {e}")
+                    row = None
+                if row is not None:
+                    self._remember(key, row[0], row[2])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, text: str) -> None:
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, now)
+            try:
+                old = self._db.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completions (key, text, size, created, used) VALUES (?, ?, ?, ?, ?)",
+                    (key, text, size, now, now),
+                )
+                self._total_bytes += size - (old[0] if old else 0)
+                self._evict()
+            except sqlite3.Error as e:
+                print(f"LLM cache write failed: {e}")
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM completions ORDER BY used LIMIT 64").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for key, size in rows:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    return
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            try:
+                entries = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            return {
+                "entries": entries,
+                "memory_entries": len(self._memory),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,53 @@
+from typing import Optional
+import os
+
+import numpy as np
+
+from services.transcript_cache import TranscriptCache
+
+
+class PcmCache(TranscriptCache):
+    """
+    Decoded 16 kHz mono audio keyed by the hash of the uploaded bytes, stored as
+    float16 .npy files (half the size of float32, far more precision than speech needs).
+    Hits are memory-mapped read-only, so retries, re-runs with another model size and
+    later passes over the same recording skip ffmpeg and share the page cache.
+    Same size-bounded LRU as the transcript cache.
+    """
+
+    _suffix = ".npy"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        with self._lock:
+            try:
+                samples = np.load(path, mmap_mode="r")
+                os.utime(path, None)  # mark as recently used
+                size = os.path.getsize(path)
+            except (OSError, ValueError):
+                self._total_bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+                return None
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self.hits += 1
+            return samples
+
+    def put(self, key: str, samples: np.ndarray) -> None:
+        if len(samples) * np.dtype(np.float16).itemsize > self.max_bytes:
+            return
+        # Written straight to the file: no in-memory .npy copy of a long recording
+        samples = np.asarray(samples, dtype=np.float16)
+
+        path = self._path(key)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, samples)
+            os.replace(tmp_path, path)
+
+            size = os.path.getsize(path)
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
@@ -0,0 +1,100 @@
+from typing import AsyncIterator, List, Optional, Tuple, Union
+import asyncio
+import re
+
+import numpy as np
+
+from core.config import settings
+from services.clean import clean_transcript_async
+from services.stt import iter_transcription
+
+# Sentence end followed by whitespace: a safe place to cut text before cleaning
+_SENTENCE_END = re.compile(r"[.!?…。](?=\s)")
+
+def _split_ready(buffer: str, min_chars: int) -> Tuple[str, str]:
+    """
+    Cut off the shortest prefix of at least `min_chars` that ends on a sentence boundary,
+    so chunks stay close to `min_chars`; without punctuation, cut at the last space
+    before `2 * min_chars`. Returns ("", buffer) when nothing can be cut yet.
+    """
+    if len(buffer) < min_chars:
+        return "", buffer
+    cut = None
+    for match in _SENTENCE_END.finditer(buffer, min_chars - 1):
+        cut = match.end()
+        break
+    if cut is None:
+        # No punctuation at all (Whisper sometimes skips it): cut at a space
+        if len(buffer) < 2 * min_chars:
+            return "", buffer
+        cut = buffer.rfind(" ", 0, 2 * min_chars)
+        if cut <= 0:
+            return "", buffer
+    return buffer[:cut].strip(), buffer[cut:]
+
+async def clean_text_chunks(texts: AsyncIterator[str]) -> Tuple[str, str]:
+    """
+    Clean text as it arrives: whenever `pipeline_clean_chunk_chars` of whole sentences
+    have been buffered they are sent to the LLM cleaner concurrently, while the
+    producer keeps going. Returns (raw text, cleaned text) with chunks in their original order.
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.pipeline_clean_concurrency))
+
+    async def _clean(chunk: str) -> str:
+        async with semaphore:
+            return await clean_transcript_async(chunk)
+
+    raw_parts: List[str] = []
+    tasks: List[asyncio.Task] = []
+    buffer = ""
+    try:
+        async for text in texts:
+            if not text:
+                continue
+            raw_parts.append(text)
+            buffer = f"{buffer} {text}" if buffer else text
+            while True:
+                ready, buffer = _split_ready(buffer, settings.pipeline_clean_chunk_chars)
+                if not ready:
+                    break
+                tasks.append(asyncio.create_task(_clean(ready)))
+        if buffer.strip():
+            tasks.append(asyncio.create_task(_clean(buffer.strip())))
+
+        cleaned = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if len(tasks) > 1:
+        print(f"Cleaned transcript in {len(tasks)} chunks")
+    return " ".join(raw_parts), " ".join(c.strip() for c in cleaned if c and c.strip())
+
+async def transcribe_and_clean(
+    audio: Union[bytes, str, np.ndarray],
+    language: Optional[str] = None,
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+    digest: Optional[str] = None,
+) -> Tuple[str, str, List[dict]]:
+    """
+    STT and cleaning overlapped: each transcribed window is cleaned while later windows are still decoding.
+    Returns (raw text, cleaned text, Whisper segments) - the segments feed acoustic diarization.
+    """
+    segments: List[dict] = []
+
+    async def _texts():
+        async for chunk in iter_transcription(audio, language, model_size, profile, digest):
+            segments.extend(chunk.get("segments", []))
+            yield chunk["text"]
+
+    raw_text, cleaned = await clean_text_chunks(_texts())
+    return raw_text, cleaned, segments
+
+async def clean_text(text: str) -> str:
+    """Clean an existing transcript, splitting long ones into chunks cleaned in parallel"""
+
+    async def _texts():
+        yield text
+
+    return (await clean_text_chunks(_texts()))[1]
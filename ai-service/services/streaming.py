@@ -0,0 +1,187 @@
+from typing import List, Optional
+import time
+
+import numpy as np
+
+from core.config import settings
+from services.audio import SAMPLE_RATE, frame_rms
+from services.stt import transcribe_samples
+
+# 30 ms VAD frames
+_VAD_FRAME = int(0.03 * SAMPLE_RATE)
+
+# Number of open streaming sessions in this worker (only touched from the event loop)
+_active_sessions = 0
+
+_ENCODINGS = {"pcm_s16le": "<i2", "pcm_f32le": "<f4"}
+
+
+class FrameDecoder:
+    """
+    Turns the client's raw PCM frames into 16 kHz float32 samples as one continuous
+    signal. Frames do not have to end on a sample boundary: leftover bytes wait for
+    the next frame. Resampling interpolates across frame boundaries (the last input
+    samples and the fractional read position are carried over), so the output is the
+    same as resampling the whole stream at once.
+    """
+
+    def __init__(self, encoding: str, sample_rate: int):
+        if encoding not in _ENCODINGS:
+            raise ValueError(f"Unsupported encoding: {encoding}. Use {' or '.join(_ENCODINGS)}")
+        if sample_rate <= 0:
+            raise ValueError(f"Invalid sample rate: {sample_rate}")
+        self.dtype = np.dtype(_ENCODINGS[encoding])
+        self.scale = 32768.0 if encoding == "pcm_s16le" else 1.0
+        self.step = sample_rate / SAMPLE_RATE  # input samples per output sample
+        self._remainder = b""
+        self._tail = np.zeros(0, dtype=np.float32)  # input samples the next output still interpolates from
+        self._position = 0.0  # read position of the next output sample within _tail + new input
+
+    def decode(self, data: bytes) -> np.ndarray:
+        data = self._remainder + data if self._remainder else data
+        usable = len(data) - len(data) % self.dtype.itemsize
+        self._remainder = data[usable:]
+        samples = np.frombuffer(data, dtype=self.dtype, count=usable // self.dtype.itemsize).astype(np.float32)
+        if self.scale != 1.0:
+            samples /= self.scale
+        if self.step == 1.0:
+            return samples
+        return self._resample(samples)
+
+    def _resample(self, samples: np.ndarray) -> np.ndarray:
+        """Linear resampling to 16 kHz, continued from the previous frame"""
+        buffer = np.concatenate([self._tail, samples]) if len(self._tail) else samples
+        last = len(buffer) - 1
+        if last < self._position:
+            self._tail = buffer
+            return np.zeros(0, dtype=np.float32)
+        n_out = int((last - self._position) // self.step) + 1
+        positions = self._position + self.step * np.arange(n_out)
+        resampled = np.interp(positions, np.arange(len(buffer)), buffer).astype(np.float32)
+
+        next_position = self._position + self.step * n_out
+        consumed = min(int(next_position), len(buffer))
+        self._tail = buffer[consumed:]
+        self._position = next_position - consumed
+        return resampled
+
+
+class StreamingSession:
+    """
+    Incremental transcription of one live audio stream.
+
+    Audio is accumulated into the current utterance. A simple energy VAD decides
+    when speech starts and when it has ended (endpointing); while speech is going
+    on, Whisper is re-run over the utterance buffer at most once per
+    `stt_stream_partial_interval_seconds` to emit a partial hypothesis, and once
+    more at the endpoint to emit the final text. Only one inference per stream
+    is in flight at any time and the buffer is capped, which bounds CPU per stream.
+    """
+
+    def __init__(self, language: Optional[str], encoding: str = "pcm_s16le", sample_rate: int = SAMPLE_RATE):
+        self.language = language
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self._decoder = FrameDecoder(encoding, sample_rate)
+        self._utterance: List[np.ndarray] = []
+        self._utterance_samples = 0
+        self._pending = np.zeros(0, dtype=np.float32)  # samples not yet long enough for a VAD frame
+        self._in_speech = False
+        self._silence_samples = 0
+        self._stream_offset = 0  # samples consumed since the session started
+        self._utterance_start = 0
+        self._last_partial_at = 0.0
+        self._last_partial_text = ""
+
+    def _utterance_audio(self) -> np.ndarray:
+        return np.concatenate(self._utterance) if self._utterance else np.zeros(0, dtype=np.float32)
+
+    async def _final(self) -> List[dict]:
+        audio = self._utterance_audio()
+        start = self._utterance_start / SAMPLE_RATE
+        end = (self._utterance_start + len(audio)) / SAMPLE_RATE
+
+        self._utterance = []
+        self._utterance_samples = 0
+        self._in_speech = False
+        self._silence_samples = 0
+        self._last_partial_text = ""
+
+        text = (await transcribe_samples(audio, self.language, settings.stt_stream_decoding_profile)).strip() if len(audio) else ""
+        if not text:
+            return []
+        return [{"type": "final", "text": text, "start": round(start, 2), "end": round(end, 2)}]
+
+    async def _partial(self) -> List[dict]:
+        self._last_partial_at = time.monotonic()
+        window = int(settings.stt_stream_max_utterance_seconds * SAMPLE_RATE)
+        audio = self._utterance_audio()[-window:]
+        text = (await transcribe_samples(audio, self.language, settings.stt_stream_decoding_profile)).strip()
+        if not text or text == self._last_partial_text:
+            return []
+        self._last_partial_text = text
+        return [{"type": "partial", "text": text}]
+
+    async def push(self, data: bytes) -> List[dict]:
+        """Feed one frame of raw audio; returns the transcript events it produced"""
+        samples = self._decoder.decode(data)
+        samples = np.concatenate([self._pending, samples]) if len(self._pending) else samples
+
+        n_frames = len(samples) // _VAD_FRAME
+        self._pending = samples[n_frames * _VAD_FRAME:]
+        if n_frames == 0:
+            return []
+
+        events: List[dict] = []
+        voiced = frame_rms(samples[: n_frames * _VAD_FRAME], _VAD_FRAME) >= settings.stt_stream_vad_threshold
+        endpoint = int(settings.stt_stream_endpoint_silence_ms * SAMPLE_RATE / 1000)
+        max_utterance = int(settings.stt_stream_max_utterance_seconds * SAMPLE_RATE)
+
+        for i, is_voiced in enumerate(voiced):
+            frame = samples[i * _VAD_FRAME:(i + 1) * _VAD_FRAME]
+            position = self._stream_offset
+            self._stream_offset += _VAD_FRAME
+
+            if not self._in_speech:
+                if not is_voiced:
+                    continue
+                self._in_speech = True
+                self._utterance_start = position
+                self._last_partial_at = time.monotonic()
+
+            self._utterance.append(frame)
+            self._utterance_samples += _VAD_FRAME
+            self._silence_samples = 0 if is_voiced else self._silence_samples + _VAD_FRAME
+
+            if self._silence_samples >= endpoint or self._utterance_samples >= max_utterance:
+                events.extend(await self._final())
+
+        if self._in_speech and time.monotonic() - self._last_partial_at >= settings.stt_stream_partial_interval_seconds:
+            events.extend(await self._partial())
+        return events
+
+    async def flush(self) -> List[dict]:
+        """Finish the stream: emit whatever is left in the utterance buffer as a final"""
+        if self._utterance:
+            return await self._final()
+        return []
+
+
+def open_session(language: Optional[str], encoding: str, sample_rate: int) -> Optional[StreamingSession]:
+    """
+    Create a session, or return None when this worker already serves the maximum number of streams.
+    Raises ValueError for an unsupported encoding or sample rate.
+    """
+    global _active_sessions
+    if _active_sessions >= settings.stt_stream_max_sessions:
+        return None
+    session = StreamingSession(language, encoding, sample_rate)
+    _active_sessions += 1
+    return session
+
+def close_session(session: StreamingSession) -> None:
+    global _active_sessions
+    _active_sessions = max(0, _active_sessions - 1)
+
+def get_streaming_stats() -> dict:
+    return {"active_sessions": _active_sessions, "max_sessions": settings.stt_stream_max_sessions}
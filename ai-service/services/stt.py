@@ -1,63 +1,914 @@
-from typing import Optional
+from typing import AsyncIterator, Optional, List, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import gc
+import hashlib
 import os
+import queue
+import re
+import threading
+import time
+
+import numpy as np
 
 try:
     import whisper
 except ImportError:
     whisper = None
 
+try:
+    import torch
+except ImportError:
+    torch = None
+
 from core.config import settings
+from services.audio import SAMPLE_RATE, load_audio, decode_audio_bytes, split_on_silence, trim_silence, remap_time
+from services.transcript_cache import TranscriptCache, make_cache_key
+from services.pcm_cache import PcmCache
+from services.cpu_allocator import cpu_job, get_cpu_stats
+
+
+class WhisperPoolBusy(RuntimeError):
+    """Raised when the STT wait queue is full or a lease times out"""
+
+
+# ------------------ MODEL LOADING ------------------
+def _quantize_int8(model):
+    """
+    Int8 dynamic quantization of every Linear layer (attention projections and MLPs),
+    which is where almost all of Whisper's CPU time goes.
+    """
+    if torch is None:
+        raise ImportError("PyTorch is required for the int8 Whisper backend")
+
+    # Whisper's Linear subclass only adds a dtype cast; turn it back into a plain
+    # nn.Linear so quantize_dynamic recognizes and swaps it
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_whisper_model(model_size: str, backend: str = "float"):
+    """Load a Whisper model on the CPU using the given backend ("float" or "int8")"""
+    if whisper is None:
+        raise ImportError(
+            "Whisper is not installed. Please install it with: pip install openai-whisper"
+        )
+    if backend == "int8":
+        model = whisper.load_model(model_size, device="cpu")
+        return _quantize_int8(model.eval())
+    if backend == "float":
+        return whisper.load_model(model_size)
+    raise ValueError(f"Unknown Whisper backend: {backend}. Options: float, int8")
+
+# Rough in-memory size per replica (MB, float weights), used before a model has been measured
+_ESTIMATED_MODEL_MB = {
+    "tiny": 150, "base": 300, "small": 1000, "medium": 3000,
+    "large": 6200, "turbo": 3300,
+}
+
+def _estimated_model_bytes(model_size: str, backend: str) -> int:
+    family = model_size.split(".")[0].split("-")[0]
+    mb = _ESTIMATED_MODEL_MB.get(family, 1000)
+    if backend == "int8":
+        mb //= 2  # Linear weights shrink 4x, embeddings and convs stay float
+    return mb * 1024 * 1024
+
+def _model_bytes(model) -> int:
+    """Bytes held by the model's tensors (packed int8 weights included)"""
+    if torch is None:
+        return 0
+    total = 0
+    for value in model.state_dict().values():
+        for tensor in (value if isinstance(value, (tuple, list)) else (value,)):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+def available_model_sizes() -> List[str]:
+    if whisper is not None:
+        return list(whisper.available_models())
+    return list(_ESTIMATED_MODEL_MB)
+
+
+# ------------------ WHISPER REPLICA POOL ------------------
+class WhisperPool:
+    """
+    Pool of N Whisper replicas. Each replica is leased to exactly one
+    transcription at a time, so concurrent requests never share model state.
+    Replicas are loaded lazily, the first time the pool needs one more.
+    """
+
+    def __init__(self, model_size: str, size: int, max_waiting: int, acquire_timeout: float, backend: str = "float"):
+        self.model_size = model_size
+        self.backend = backend
+        self.size = max(1, size)
+        self.max_waiting = max(0, max_waiting)
+        self.acquire_timeout = acquire_timeout
+        self._idle: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._loaded = 0
+        self._leased = 0
+        self._waiting = 0
+        self.replica_bytes = _estimated_model_bytes(model_size, backend)
+        self.last_used = time.monotonic()
+
+    def _load_replica(self):
+        _make_room(self)
+        print(f"Loading Whisper model ({self.model_size}, {self.backend}) replica {self._loaded}/{self.size}... This may take a while on first run.")
+        model = load_whisper_model(self.model_size, self.backend)
+        self.replica_bytes = _model_bytes(model) or self.replica_bytes
+        print(f"Whisper model loaded successfully ({self.replica_bytes / 1024 / 1024:.0f} MB).")
+        return model
+
+    def acquire(self, timeout: Optional[float] = None, admitted: bool = False):
+        """
+        Lease a replica, loading a new one if the pool is not full yet.
+        `admitted` is for later windows of a job that already got a replica: they are
+        not refused for a full queue and wait as long as it takes, since failing them
+        would throw away the windows already transcribed.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+
+        with self._lock:
+            if self._idle.empty() and self._loaded < self.size:
+                # Reserve the slot before loading so other threads don't overshoot
+                self._loaded += 1
+                load_new = True
+            else:
+                if self._idle.empty() and self._waiting >= self.max_waiting and not admitted:
+                    raise WhisperPoolBusy(
+                        f"All {self.size} Whisper replicas are busy and {self._waiting} requests are already waiting"
+                    )
+                self._waiting += 1
+                load_new = False
+
+        if load_new:
+            try:
+                model = self._load_replica()
+            except Exception:
+                with self._lock:
+                    self._loaded -= 1
+                raise
+        else:
+            try:
+                model = self._idle.get(timeout=None if admitted else timeout)
+            except queue.Empty:
+                raise WhisperPoolBusy(f"Timed out after {timeout}s waiting for a Whisper replica")
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+        with self._lock:
+            self._leased += 1
+            self.last_used = time.monotonic()
+        return model
+
+    def release(self, model) -> None:
+        with self._lock:
+            self._leased -= 1
+            self.last_used = time.monotonic()
+        self._idle.put(model)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._loaded * self.replica_bytes
+
+    def evict_idle(self, max_replicas: Optional[int] = None) -> int:
+        """Unload replicas that are not leased right now; returns how many were dropped"""
+        dropped = 0
+        with self._lock:
+            while not self._idle.empty() and (max_replicas is None or dropped < max_replicas):
+                try:
+                    self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._loaded -= 1
+                dropped += 1
+        if dropped:
+            gc.collect()
+        return dropped
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None, admitted: bool = False):
+        model = self.acquire(timeout, admitted)
+        try:
+            yield model
+        finally:
+            self.release(model)
 
-# Global model cache
-_whisper_model = None
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model_size": self.model_size,
+                "backend": self.backend,
+                "size": self.size,
+                "loaded": self._loaded,
+                "leased": self._leased,
+                "waiting": self._waiting,
+                "max_waiting": self.max_waiting,
+                "memory_mb": round(self.memory_bytes / 1024 / 1024, 1),
+                "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            }
 
-def _get_whisper_model():
-    """Lazy load Whisper model to avoid loading on import"""
-    global _whisper_model
-    if _whisper_model is None:
-        if whisper is None:
-            raise ImportError(
-                "Whisper is not installed. Please install it with: pip install openai-whisper"
+
+# Global pools (one per model size/backend, least recently used first) and executor
+_whisper_pools: "OrderedDict[tuple, WhisperPool]" = OrderedDict()
+_stt_executor: Optional[ThreadPoolExecutor] = None
+_transcript_cache: Optional[TranscriptCache] = None
+_pcm_cache: Optional[PcmCache] = None
+_pool_init_lock = threading.RLock()
+# Requests submitted to the executor and not finished yet (only touched from the event loop)
+_pending_jobs = 0
+
+def _get_whisper_pool(model_size: Optional[str] = None) -> WhisperPool:
+    """Pool for the given model size (default `whisper_model_size`), marked as most recently used"""
+    key = (model_size or settings.whisper_model_size, settings.whisper_backend)
+    with _pool_init_lock:
+        pool = _whisper_pools.get(key)
+        if pool is None:
+            pool = WhisperPool(
+                model_size=key[0],
+                size=settings.whisper_pool_size,
+                max_waiting=settings.whisper_pool_max_waiting,
+                acquire_timeout=settings.whisper_pool_acquire_timeout,
+                backend=key[1],
             )
-        
-        # Luôn sử dụng tiny model để tiết kiệm tài nguyên
-        model_size = settings.whisper_model_size
-        print(f"Loading Whisper model ({model_size})... This may take a while on first run.")
-        _whisper_model = whisper.load_model(model_size)
-        print(f"Whisper model loaded successfully.")
-    
-    return _whisper_model
+            _whisper_pools[key] = pool
+        _whisper_pools.move_to_end(key)
+    return pool
+
+def _make_room(loading: WhisperPool) -> None:
+    """Before loading a replica, unload idle replicas of least recently used models until it fits the budget"""
+    budget = settings.whisper_memory_budget_mb * 1024 * 1024
+    with _pool_init_lock:
+        pools = [pool for pool in _whisper_pools.values() if pool is not loading]
+        # The slot being loaded is already counted in `loading.memory_bytes`
+        used = sum(pool.memory_bytes for pool in _whisper_pools.values())
+        for pool in pools:  # least recently used first
+            while used > budget and pool.evict_idle(max_replicas=1):
+                used -= pool.replica_bytes
+                print(f"Unloaded an idle {pool.model_size} Whisper replica to stay within the memory budget")
+    if used > budget:
+        print(f"⚠️ Loading {loading.model_size} exceeds the Whisper memory budget ({budget / 1024 / 1024:.0f} MB); other models are busy")
+
+def evict_idle_models() -> int:
+    """Unload every replica of models unused for longer than `whisper_model_idle_seconds`"""
+    dropped = 0
+    now = time.monotonic()
+    with _pool_init_lock:
+        pools = list(_whisper_pools.values())
+    for pool in pools:
+        if now - pool.last_used >= settings.whisper_model_idle_seconds:
+            count = pool.evict_idle()
+            if count:
+                print(f"Unloaded {count} idle {pool.model_size} Whisper replica(s)")
+            dropped += count
+    return dropped
+
+def _get_stt_executor() -> ThreadPoolExecutor:
+    """Dedicated threads for inference so STT never blocks the event loop or the default executor"""
+    global _stt_executor
+    if _stt_executor is None:
+        with _pool_init_lock:
+            if _stt_executor is None:
+                _stt_executor = ThreadPoolExecutor(
+                    max_workers=max(1, settings.whisper_pool_size) + max(0, settings.whisper_pool_max_waiting),
+                    thread_name_prefix="whisper",
+                )
+    return _stt_executor
+
+def _get_transcript_cache() -> Optional[TranscriptCache]:
+    global _transcript_cache
+    if _transcript_cache is None and settings.transcript_cache_enabled:
+        with _pool_init_lock:
+            if _transcript_cache is None:
+                _transcript_cache = TranscriptCache(
+                    settings.transcript_cache_dir,
+                    max_bytes=settings.transcript_cache_max_mb * 1024 * 1024,
+                )
+    return _transcript_cache
+
+def _get_pcm_cache() -> Optional[PcmCache]:
+    global _pcm_cache
+    if _pcm_cache is None and settings.pcm_cache_enabled:
+        with _pool_init_lock:
+            if _pcm_cache is None:
+                _pcm_cache = PcmCache(
+                    settings.pcm_cache_dir,
+                    max_bytes=settings.pcm_cache_max_mb * 1024 * 1024,
+                )
+    return _pcm_cache
+
+def get_stt_stats() -> dict:
+    """Current pool and cache usage, for monitoring"""
+    cache = _get_transcript_cache()
+    pcm_cache = _get_pcm_cache()
+    stats = {
+        "pending_jobs": _pending_jobs,
+        "cache": cache.stats() if cache else None,
+        "pcm_cache": pcm_cache.stats() if pcm_cache else None,
+        "cpu": get_cpu_stats(),
+    }
+    if settings.whisper_server_address:
+        # Replicas live in the inference server process
+        stats["server"] = settings.whisper_server_address
+    else:
+        with _pool_init_lock:
+            pools = list(_whisper_pools.values())
+        stats["pools"] = [pool.stats() for pool in pools]
+        stats["memory_mb"] = round(sum(pool.memory_bytes for pool in pools) / 1024 / 1024, 1)
+        stats["memory_budget_mb"] = settings.whisper_memory_budget_mb
+    return stats
 
-async def transcribe_audio(file_path: str, language: Optional[str] = None) -> str:
+def resolve_model_size(requested: Optional[str], duration_s: float) -> str:
     """
-    Transcribe audio file using Whisper (local model).
+    Model size for one request: None means `whisper_model_size`, "auto" picks by
+    duration from `whisper_auto_model_rules` (bigger models for short clips).
     """
-    if not os.path.exists(file_path):
-        raise ValueError(f"Audio file not found: {file_path}")
+    if not requested:
+        return settings.whisper_model_size
+    if requested == "auto":
+        for max_seconds, model_size in settings.whisper_auto_model_rules:
+            if duration_s <= max_seconds:
+                return model_size
+        return settings.whisper_model_size
+    return requested
 
-    try:
-        model = _get_whisper_model()
-        
-        # Map language code
-        whisper_lang = language or "en"
-        if whisper_lang == "vi":
-            whisper_lang = "vi"
-        
-        # Transcribe audio
-        print(f"Transcribing audio file: {file_path}")
+def is_valid_model_size(model_size: Optional[str]) -> bool:
+    return not model_size or model_size == "auto" or model_size in available_model_sizes()
+
+def is_valid_profile(profile: Optional[str]) -> bool:
+    return not profile or profile in settings.whisper_decoding_profiles
+
+def get_decoding_options(profile: Optional[str] = None) -> dict:
+    """
+    model.transcribe keyword arguments for a named decoding profile (default `whisper_decoding_profile`).
+    Profiles bound beam size, best_of and the temperature fallback ladder, which is what
+    decides the worst-case latency on noisy audio.
+    """
+    name = profile or settings.whisper_decoding_profile
+    if name not in settings.whisper_decoding_profiles:
+        raise ValueError(f"Unknown decoding profile: {name}. Options: {', '.join(settings.whisper_decoding_profiles)}")
+    options = dict(settings.whisper_decoding_profiles[name])
+    options["temperature"] = tuple(options.get("temperature", (0.0,)))
+    return options
+
+# ------------------ TRANSCRIPTION ------------------
+def _segment_dict(segment: dict, offset: float = 0.0) -> dict:
+    """Keep the per-segment fields later stages use (timing and confidence)"""
+    return {
+        "start": round(float(segment["start"]) + offset, 3),
+        "end": round(float(segment["end"]) + offset, 3),
+        "text": segment.get("text", "").strip(),
+        "avg_logprob": segment.get("avg_logprob"),
+        "no_speech_prob": segment.get("no_speech_prob"),
+        "compression_ratio": segment.get("compression_ratio"),
+    }
+
+def _transcribe_sync(
+    audio,
+    language: Optional[str],
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+    timeout: Optional[float] = None,
+    admitted: bool = False,
+) -> dict:
+    """
+    Run Whisper on a leased replica. `audio` is a file path or a 16 kHz array (float16
+    slices of the PCM cache are cast here, one window at a time).
+    `timeout` and `admitted` are passed to WhisperPool.acquire (see _JobWindows).
+    Returns {"text": ..., "segments": [...]} with segment times relative to `audio`.
+    """
+    if not isinstance(audio, str):
+        audio = np.asarray(audio, dtype=np.float32)
+    # Map language code
+    whisper_lang = language or "en"
+    if whisper_lang == "vi":
+        whisper_lang = "vi"
+
+    options = get_decoding_options(profile)
+    with _get_whisper_pool(model_size).lease(timeout, admitted) as model, cpu_job() as cores:
+        print(f"Transcribing audio ({model_size or settings.whisper_model_size}, {len(cores) if cores else 'all'} cores): {audio if isinstance(audio, str) else f'{len(audio) / SAMPLE_RATE:.1f}s'}")
+        started = time.perf_counter()
         result = model.transcribe(
-            file_path,
+            audio,
             language=whisper_lang if whisper_lang != "auto" else None,
-            fp16=False  # Set to False for CPU, True for GPU
+            fp16=False,  # Set to False for CPU, True for GPU
+            **options,
         )
-        
-        transcript = result.get("text", "").strip()
-        
-        if not transcript:
-            raise ValueError("Transcription resulted in empty text")
-        
-        print(f"Transcription completed. Length: {len(transcript)} characters")
-        return transcript
 
+    transcript = result.get("text", "").strip()
+    print(f"Transcription completed in {time.perf_counter() - started:.1f}s. Length: {len(transcript)} characters")
+    return {
+        "text": transcript,
+        "segments": [_segment_dict(seg) for seg in result.get("segments", [])],
+    }
+
+def _transcribe_window_sync(
+    audio,
+    language: Optional[str],
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+    timeout: Optional[float] = None,
+    admitted: bool = False,
+) -> dict:
+    if settings.whisper_server_address:
+        from services.whisper_server import remote_transcribe
+        return remote_transcribe(audio, language, model_size, profile, timeout, admitted)
+    return _transcribe_sync(audio, language, model_size, profile, timeout, admitted)
+
+class _JobWindows:
+    """
+    Runs the Whisper windows of one job (a long recording, its refine passes, an upload
+    session). At most `whisper_pool_size` windows are in flight at a time, so a long
+    recording never floods the pool queue (or the inference server's) with its own windows.
+    `whisper_pool_acquire_timeout` applies once per job: until one window got a replica the
+    windows share a single deadline, after that the job is admitted and its windows wait their turn.
+    """
+
+    def __init__(self):
+        self._slots = asyncio.Semaphore(max(1, settings.whisper_pool_size))
+        self._deadline: Optional[float] = None
+        self._admitted = False
+
+    async def run(self, loop, executor, audio, language: Optional[str], model_size: Optional[str] = None, profile: Optional[str] = None) -> dict:
+        if self._deadline is None:
+            self._deadline = time.monotonic() + settings.whisper_pool_acquire_timeout
+        async with self._slots:
+            timeout = max(0.0, self._deadline - time.monotonic())
+            result = await loop.run_in_executor(
+                executor, _transcribe_window_sync, audio, language, model_size, profile, timeout, self._admitted
+            )
+        self._admitted = True
+        return result
+
+# ------------------ LONG AUDIO STITCHING ------------------
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+def _stitch_pair(left: str, right: str, max_words: int = 30) -> str:
+    """
+    Drop the beginning of `right` that repeats the end of `left`
+    (both windows transcribed the same overlap audio).
+    """
+    left_words = left.split()
+    right_words = right.split()
+    if not left_words or not right_words:
+        return right
+
+    tail = [_normalize_word(w) for w in left_words[-max_words:]]
+    head = [_normalize_word(w) for w in right_words[:max_words]]
+
+    # Longest run of tail-suffix words found near the start of the next window
+    best_end = 0
+    best_len = 0
+    for k in range(min(len(tail), len(head)), 0, -1):
+        suffix = tail[-k:]
+        for i in range(0, len(head) - k + 1):
+            if head[i:i + k] == suffix:
+                best_end, best_len = i + k, k
+                break
+        if best_len:
+            break
+
+    # A single repeated word at a non-zero offset is more likely chance than overlap
+    if best_len == 0 or (best_len == 1 and best_end > 1):
+        return right
+    return " ".join(right_words[best_end:])
+
+def stitch_transcripts(texts: List[str]) -> str:
+    """Join window transcripts in order, removing the text duplicated by window overlaps"""
+    stitched: List[str] = []
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        if stitched:
+            text = _stitch_pair(stitched[-1], text)
+        if text:
+            stitched.append(text)
+    return " ".join(stitched)
+
+async def _transcribe_long(
+    loop, executor, jobs: _JobWindows, audio, language: Optional[str], model_size: Optional[str] = None, profile: Optional[str] = None
+) -> dict:
+    """Transcribe overlapping windows in parallel across the replicas, then stitch them"""
+    windows = split_on_silence(
+        audio,
+        window_s=settings.whisper_chunk_seconds,
+        overlap_s=settings.whisper_chunk_overlap_seconds,
+        search_s=settings.whisper_chunk_silence_search_seconds,
+    )
+    print(f"Long audio ({len(audio) / SAMPLE_RATE:.0f}s): transcribing {len(windows)} windows in parallel")
+    results = await asyncio.gather(*[
+        jobs.run(loop, executor, audio[start:end], language, model_size, profile)
+        for start, end in windows
+    ])
+
+    segments = []
+    for i, result in enumerate(results):
+        segments.extend(_owned_segments(windows, i, result))
+
+    return {"text": stitch_transcripts([r["text"] for r in results]), "segments": segments}
+
+def _owned_segments(windows: List[tuple], i: int, result: dict) -> List[dict]:
+    """
+    Segments of window `i` shifted to absolute time. Each window owns the audio up to
+    the middle of its overlaps; segments outside it are duplicates of a neighbour's.
+    """
+    start, end = windows[i]
+    own_start = 0.0 if i == 0 else (windows[i - 1][1] + start) / 2 / SAMPLE_RATE
+    own_end = float("inf") if i == len(windows) - 1 else (end + windows[i + 1][0]) / 2 / SAMPLE_RATE
+    owned = []
+    for segment in result["segments"]:
+        shifted = _segment_dict(segment, offset=start / SAMPLE_RATE)
+        if segment.get("refined"):
+            shifted["refined"] = True
+        if own_start <= (shifted["start"] + shifted["end"]) / 2 < own_end:
+            owned.append(shifted)
+    return owned
+
+# ------------------ CONFIDENCE REFINEMENT ------------------
+def _needs_refine(segment: dict) -> bool:
+    no_speech = segment.get("no_speech_prob")
+    if no_speech is not None and no_speech >= settings.whisper_refine_no_speech_threshold:
+        return False
+    logprob = segment.get("avg_logprob")
+    ratio = segment.get("compression_ratio")
+    return (
+        (logprob is not None and logprob < settings.whisper_refine_logprob_threshold)
+        or (ratio is not None and ratio > settings.whisper_refine_compression_ratio_threshold)
+    )
+
+def _low_confidence_runs(segments: List[dict]) -> List[tuple]:
+    """(first, last) indices of consecutive segments that need a second pass"""
+    runs = []
+    for i, segment in enumerate(segments):
+        if not _needs_refine(segment):
+            continue
+        if runs and runs[-1][1] == i - 1:
+            runs[-1] = (runs[-1][0], i)
+        else:
+            runs.append((i, i))
+    return runs
+
+async def _refine_low_confidence(
+    loop, executor, jobs: _JobWindows, audio, result: dict, language: Optional[str], model_size: str, profile: Optional[str] = None
+) -> dict:
+    """
+    Re-transcribe only the low-confidence stretches of `result` with `whisper_refine_model_size`
+    and splice the new segments in. Segment times must be relative to `audio`.
+    """
+    refine_size = settings.whisper_refine_model_size
+    segments = result["segments"]
+    runs = _low_confidence_runs(segments) if refine_size != model_size else []
+    if not runs:
+        return result
+
+    padding = settings.whisper_refine_padding_seconds
+    regions = []
+    for first, last in runs:
+        start = max(0.0, segments[first]["start"] - padding)
+        end = min(len(audio) / SAMPLE_RATE, segments[last]["end"] + padding)
+        regions.append((int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)))
+
+    refined_seconds = sum(end - start for start, end in regions) / SAMPLE_RATE
+    print(f"Refining {sum(last - first + 1 for first, last in runs)}/{len(segments)} low-confidence segments "
+          f"({refined_seconds:.1f}s of {len(audio) / SAMPLE_RATE:.1f}s) with {refine_size}")
+    refined = await asyncio.gather(*[
+        jobs.run(loop, executor, audio[start:end], language, refine_size, profile)
+        for start, end in regions
+    ])
+
+    spliced = []
+    previous = 0
+    for (first, last), (start, _), second in zip(runs, regions, refined):
+        spliced.extend(segments[previous:first])
+        low, high = segments[first]["start"], segments[last]["end"]
+        replacement = []
+        for segment in second["segments"]:
+            if not segment.get("text", "").strip():
+                continue
+            shifted = _segment_dict(segment, offset=start / SAMPLE_RATE)
+            # The padding is only context: keep the spliced times inside the replaced stretch
+            shifted["start"] = min(max(shifted["start"], low), high)
+            shifted["end"] = min(max(shifted["end"], shifted["start"]), high)
+            shifted["refined"] = True
+            replacement.append(shifted)
+        # Keep the first pass if the larger model heard nothing
+        spliced.extend(replacement or segments[first:last + 1])
+        previous = last + 1
+    spliced.extend(segments[previous:])
+
+    return {"text": " ".join(s["text"] for s in spliced if s["text"]), "segments": spliced}
+
+async def _trim(loop, executor, audio):
+    """Silence trimming in the executor; returns the trimmed audio and the remap table (None if disabled)"""
+    if not settings.whisper_vad_trim:
+        return audio, None
+    original_seconds = len(audio) / SAMPLE_RATE
+    audio, remap = await loop.run_in_executor(
+        executor,
+        lambda: trim_silence(
+            audio,
+            threshold_db=settings.whisper_vad_threshold_db,
+            min_silence_s=settings.whisper_vad_min_silence_seconds,
+            padding_s=settings.whisper_vad_padding_seconds,
+            relative_db=settings.whisper_vad_relative_db or None,
+        ),
+    )
+    if original_seconds:
+        print(f"VAD kept {len(audio) / SAMPLE_RATE:.1f}s of {original_seconds:.1f}s audio")
+    return audio, remap
+
+def _remap_segments(segments: List[dict], remap) -> None:
+    if remap is None:
+        return
+    for segment in segments:
+        segment["start"] = round(remap_time(segment["start"], remap), 3)
+        segment["end"] = round(remap_time(segment["end"], remap), 3)
+
+async def _run_transcription(
+    loop, executor, audio, language: Optional[str], model_size: Optional[str] = None, profile: Optional[str] = None
+) -> dict:
+    """Silence trimming, then single-pass or chunked transcription, then timestamps mapped back"""
+    original_seconds = len(audio) / SAMPLE_RATE
+    audio, remap = await _trim(loop, executor, audio)
+    if not len(audio):
+        return {"text": "", "segments": []}
+
+    model_size = resolve_model_size(model_size, original_seconds)
+    jobs = _JobWindows()
+    if len(audio) / SAMPLE_RATE >= settings.whisper_long_audio_seconds:
+        result = await _transcribe_long(loop, executor, jobs, audio, language, model_size, profile)
+    else:
+        result = await jobs.run(loop, executor, audio, language, model_size, profile)
+    if settings.whisper_refine_enabled:
+        result = await _refine_low_confidence(loop, executor, jobs, audio, result, language, model_size, profile)
+
+    _remap_segments(result["segments"], remap)
+    return result
+
+async def _transcribe_refined_window(
+    loop, executor, jobs: _JobWindows, audio, language: Optional[str], model_size: str, profile: Optional[str] = None
+) -> dict:
+    result = await jobs.run(loop, executor, audio, language, model_size, profile)
+    if settings.whisper_refine_enabled:
+        result = await _refine_low_confidence(loop, executor, jobs, audio, result, language, model_size, profile)
+    return result
+
+async def transcribe_samples(audio, language: Optional[str] = None, profile: Optional[str] = None) -> str:
+    """Transcribe an already-decoded 16 kHz float32 buffer (may return an empty string)"""
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_get_stt_executor(), _transcribe_window_sync, audio, language, None, profile)
+    except WhisperPoolBusy:
+        raise
+    except Exception as e:
+        raise ValueError(f"Whisper transcription failed: {e}")
+    return result["text"]
+
+def _decode_options() -> dict:
+    """Settings that change the transcript, and therefore belong in the cache key"""
+    return {
+        "backend": settings.whisper_backend,
+        "fp16": False,
+        "long_audio_seconds": settings.whisper_long_audio_seconds,
+        "chunk_seconds": settings.whisper_chunk_seconds,
+        "chunk_overlap_seconds": settings.whisper_chunk_overlap_seconds,
+        "vad": [
+            settings.whisper_vad_trim,
+            settings.whisper_vad_threshold_db,
+            settings.whisper_vad_min_silence_seconds,
+            settings.whisper_vad_padding_seconds,
+            settings.whisper_vad_relative_db,
+        ],
+        "refine": [
+            settings.whisper_refine_model_size,
+            settings.whisper_refine_logprob_threshold,
+            settings.whisper_refine_compression_ratio_threshold,
+            settings.whisper_refine_no_speech_threshold,
+            settings.whisper_refine_padding_seconds,
+        ] if settings.whisper_refine_enabled else None,
+    }
+
+def audio_digest(data: bytes) -> str:
+    """Content hash of an upload; keys both the transcript cache and the PCM cache"""
+    return hashlib.sha256(data).hexdigest()
+
+def _cache_key_sync(
+    digest: str, language: Optional[str], model_size: Optional[str] = None, profile: Optional[str] = None
+) -> str:
+    options = _decode_options()
+    options["decoding"] = {k: list(v) if isinstance(v, tuple) else v for k, v in get_decoding_options(profile).items()}
+    if model_size == "auto":
+        options["auto_model_rules"] = [list(rule) for rule in settings.whisper_auto_model_rules]
+    return make_cache_key(digest, model_size or settings.whisper_model_size, language, options)
+
+async def _check_request(
+    audio, language: Optional[str], model_size: Optional[str], profile: Optional[str] = None, digest: Optional[str] = None
+):
+    """
+    Validate a request, look it up in the transcript cache and apply admission control.
+    Returns (cache, cache key, cached result, digest of the uploaded bytes); the digest is
+    computed once here and reused as the PCM cache key when the audio is decoded.
+    """
+    if isinstance(audio, str) and not os.path.exists(audio):
+        raise ValueError(f"Audio file not found: {audio}")
+    if not is_valid_model_size(model_size):
+        raise ValueError(f"Unknown Whisper model size: {model_size}. Options: auto, {', '.join(available_model_sizes())}")
+    get_decoding_options(profile)  # raises on an unknown profile
+
+    is_upload = isinstance(audio, (bytes, bytearray))
+    cache = _get_transcript_cache() if is_upload else None
+    if is_upload and digest is None and (cache is not None or _get_pcm_cache() is not None):
+        digest = await asyncio.to_thread(audio_digest, audio)
+    cache_key = None
+    if cache is not None:
+        cache_key = _cache_key_sync(digest, language, model_size, profile)
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached:
+            print(f"Transcript cache hit ({len(cached['text'])} characters)")
+            return cache, cache_key, cached, digest
+
+    if _pending_jobs >= settings.whisper_pool_size + settings.whisper_pool_max_waiting:
+        raise WhisperPoolBusy(f"STT queue is full ({_pending_jobs} jobs in flight)")
+    return cache, cache_key, None, digest
+
+async def _cache_put(cache: Optional[TranscriptCache], cache_key: Optional[str], result: dict) -> None:
+    if cache is None:
+        return
+    try:
+        await asyncio.to_thread(cache.put, cache_key, result)
+    except OSError as e:
+        print(f"Could not write transcript cache: {e}")
+
+def decode_audio_cached(data: bytes, digest: Optional[str] = None) -> np.ndarray:
+    """
+    Decode uploaded bytes to 16 kHz audio, reusing the PCM cache: a recording that was
+    decoded before (retry, another model size, diarization on audio) is memory-mapped
+    instead of going through ffmpeg again. A cache hit is the read-only float16 mapping
+    itself, not a float32 copy of the whole recording: consumers cast the window or
+    segment they work on. `digest` is audio_digest(data) when the caller already has it.
+    """
+    cache = _get_pcm_cache()
+    if cache is None:
+        return decode_audio_bytes(data)
+
+    digest = digest or audio_digest(data)
+    samples = cache.get(digest)
+    if samples is not None:
+        print(f"PCM cache hit ({len(samples) / SAMPLE_RATE:.1f}s audio)")
+        return samples
+
+    samples = decode_audio_bytes(data)
+    try:
+        cache.put(digest, samples)
+    except OSError as e:
+        print(f"Could not write PCM cache: {e}")
+    return samples
+
+def _decode_sync(audio, digest: Optional[str] = None):
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        return decode_audio_cached(bytes(audio) if not isinstance(audio, bytes) else audio, digest)
+    if isinstance(audio, str):
+        return load_audio(audio)
+    return audio
+
+async def transcribe_audio_detailed(
+    audio: Union[bytes, str, np.ndarray],
+    language: Optional[str] = None,
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+    digest: Optional[str] = None,
+) -> dict:
+    """
+    Transcribe audio using Whisper (local model).
+    `audio` is the raw uploaded bytes (decoded in memory), a file path, or a 16 kHz float32 array.
+    Returns {"text": ..., "segments": [{"start", "end", "text", "avg_logprob", ...}]},
+    with segment times in seconds of the original audio.
+
+    Inference runs on a leased replica in a worker thread, so the event loop keeps serving other requests.
+    If `whisper_server_address` is set, the model runs in the shared inference server process instead.
+    Silence is trimmed before inference, and recordings longer than `whisper_long_audio_seconds`
+    are split into windows transcribed in parallel. With `whisper_refine_enabled`, low-confidence
+    segments are re-run on `whisper_refine_model_size` and spliced back in.
+    Raw uploads are looked up in the transcript cache first, so re-uploading the same recording is free.
+
+    `model_size` overrides `whisper_model_size` for this request ("auto" picks by duration);
+    models are loaded on demand and unloaded again when idle or over the memory budget.
+    `profile` picks one of `whisper_decoding_profiles` (fast / balanced / accurate).
+    `digest` is audio_digest(audio) when the caller has already hashed the upload.
+    """
+    cache, cache_key, cached, digest = await _check_request(audio, language, model_size, profile, digest)
+    if cached:
+        return cached
+
+    global _pending_jobs
+    loop = asyncio.get_running_loop()
+    executor = _get_stt_executor()
+    _pending_jobs += 1
+    try:
+        audio = await loop.run_in_executor(executor, _decode_sync, audio, digest)
+        result = await _run_transcription(loop, executor, audio, language, model_size, profile)
+    except WhisperPoolBusy:
+        raise
+    except Exception as e:
+        raise ValueError(f"Whisper transcription failed: {e}")
+    finally:
+        _pending_jobs -= 1
+
+    if not result["text"]:
+        raise ValueError("Whisper transcription failed: Transcription resulted in empty text")
+
+    await _cache_put(cache, cache_key, result)
+    return result
+
+async def iter_transcription(
+    audio: Union[bytes, str, np.ndarray],
+    language: Optional[str] = None,
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+    digest: Optional[str] = None,
+) -> AsyncIterator[dict]:
+    """
+    Same transcript as transcribe_audio_detailed, but yielded window by window in order
+    ({"text", "segments"} per window, overlaps already removed), so the caller can start
+    working on the beginning of a recording while the rest is still being decoded.
+    Like transcribe_audio_detailed, audio shorter than `whisper_long_audio_seconds` is
+    one window, so it only streams for long recordings.
+
+    Windows run in order, at most `whisper_pool_size` at a time; window i is yielded as
+    soon as it and all windows before it are done. A cache hit is yielded as a single chunk.
+    """
+    cache, cache_key, cached, digest = await _check_request(audio, language, model_size, profile, digest)
+    if cached:
+        yield cached
+        return
+
+    global _pending_jobs
+    loop = asyncio.get_running_loop()
+    executor = _get_stt_executor()
+    _pending_jobs += 1
+    tasks = []
+    texts: List[str] = []
+    segments: List[dict] = []
+    try:
+        audio = await loop.run_in_executor(executor, _decode_sync, audio, digest)
+        original_seconds = len(audio) / SAMPLE_RATE
+        audio, remap = await _trim(loop, executor, audio)
+        model_size = resolve_model_size(model_size, original_seconds)
+        if not len(audio):
+            windows = []
+        elif len(audio) / SAMPLE_RATE < settings.whisper_long_audio_seconds:
+            # Same single pass as transcribe_audio_detailed, so both return the same transcript
+            windows = [(0, len(audio))]
+        else:
+            windows = split_on_silence(
+                audio,
+                window_s=settings.whisper_chunk_seconds,
+                overlap_s=settings.whisper_chunk_overlap_seconds,
+                search_s=settings.whisper_chunk_silence_search_seconds,
+            )
+        jobs = _JobWindows()
+        tasks = [
+            asyncio.ensure_future(_transcribe_refined_window(loop, executor, jobs, audio[start:end], language, model_size, profile))
+            for start, end in windows
+        ]
+
+        for i, task in enumerate(tasks):
+            result = await task
+            owned = _owned_segments(windows, i, result)
+            _remap_segments(owned, remap)
+            text = result["text"].strip()
+            if texts and text:
+                text = _stitch_pair(texts[-1], text)
+            if text:
+                texts.append(text)
+            segments.extend(owned)
+            yield {"text": text, "segments": owned}
+    except WhisperPoolBusy:
+        raise
     except Exception as e:
         raise ValueError(f"Whisper transcription failed: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()  # the consumer gave up early
+        _pending_jobs -= 1
+
+    if not texts:
+        raise ValueError("Whisper transcription failed: Transcription resulted in empty text")
+    await _cache_put(cache, cache_key, {"text": " ".join(texts), "segments": segments})
+
+async def transcribe_audio(
+    audio: Union[bytes, str, np.ndarray],
+    language: Optional[str] = None,
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+) -> str:
+    """Transcribe audio and return only the transcript text (see transcribe_audio_detailed)"""
+    return (await transcribe_audio_detailed(audio, language, model_size, profile))["text"]
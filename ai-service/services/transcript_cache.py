@@ -0,0 +1,114 @@
+from typing import Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def make_cache_key(audio_digest: str, model_size: str, language: Optional[str], options: dict) -> str:
+    """Key = hash of the audio bytes + everything that changes the transcript"""
+    payload = json.dumps(
+        {"audio": audio_digest, "model": model_size, "language": language or "auto", "options": options},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TranscriptCache:
+    """
+    Content-addressed on-disk transcript cache with size-bounded LRU eviction.
+    Values are transcription results ({"text": ..., "segments": [...]}).
+    Each entry is one small JSON file; the LRU order is kept in memory and
+    persisted through the file mtimes so it survives restarts.
+    """
+
+    _suffix = ".json"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{self._suffix}")
+
+    def _load_index(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self._suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name[:-len(self._suffix)], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        with self._lock:
+            # Read from disk even if the key is not indexed: another worker may have written it
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    result = json.load(f)["result"]
+                os.utime(path, None)  # mark as recently used
+                size = os.path.getsize(path)
+            except (OSError, ValueError, KeyError):
+                self._total_bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+                return None
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self.hits += 1
+            return result
+
+    def put(self, key: str, result: dict) -> None:
+        path = self._path(key)
+        data = json.dumps({"result": result, "created": time.time()}, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,357 @@
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import os
+import subprocess
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from core.config import settings
+from services.audio import SAMPLE_RATE, _ffmpeg_command, decode_audio_bytes, next_window
+from services.stt import (
+    _JobWindows,
+    _get_pcm_cache,
+    _get_stt_executor,
+    _owned_segments,
+    WhisperPoolBusy,
+    _remap_segments,
+    _stitch_pair,
+    _transcribe_refined_window,
+    _trim,
+    get_decoding_options,
+    is_valid_model_size,
+    resolve_model_size,
+)
+
+
+class UploadConflict(ValueError):
+    """A chunk does not continue the upload; the client should resume from `received`"""
+
+    def __init__(self, received: int):
+        super().__init__(f"Upload is at byte {received}")
+        self.received = received
+
+
+# ------------------ INCREMENTAL DECODING ------------------
+class _StreamDecoder:
+    """
+    ffmpeg reading the upload from stdin as it arrives and writing 16 kHz mono PCM to
+    stdout, collected by a reader thread into a growing buffer. Works for streamable
+    formats (WAV, MP3, OGG/Opus, WebM, FLAC, ...); for MP4/M4A with the index at the
+    end ffmpeg fails and the upload is decoded as a whole once it is complete.
+    """
+
+    def __init__(self):
+        self._buffer = np.zeros(SAMPLE_RATE * 60, dtype=np.int16)
+        self._length = 0
+        self._lock = threading.Lock()
+        self.failed = False
+        try:
+            self._proc = subprocess.Popen(
+                _ffmpeg_command("pipe:0"), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            self._proc = None
+            self.failed = True
+            return
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        leftover = b""
+        while True:
+            data = self._proc.stdout.read(65536)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % 2
+            leftover = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype="<i2")
+            with self._lock:
+                if self._length + len(samples) > len(self._buffer):
+                    grown = np.zeros(max(2 * len(self._buffer), self._length + len(samples)), dtype=np.int16)
+                    grown[:self._length] = self._buffer[:self._length]
+                    self._buffer = grown
+                self._buffer[self._length:self._length + len(samples)] = samples
+                self._length += len(samples)
+
+    def feed(self, chunk: bytes) -> None:
+        if self.failed:
+            return
+        try:
+            self._proc.stdin.write(chunk)
+            self._proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            # ffmpeg gave up on this input; the complete upload is decoded at finalize
+            self.failed = True
+
+    def samples(self) -> np.ndarray:
+        """PCM decoded so far (int16 view, valid until the next read)"""
+        with self._lock:
+            return self._buffer[:self._length]
+
+    def close(self) -> None:
+        """End of input: wait for ffmpeg to flush the tail"""
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        self._reader.join()
+        stderr = self._proc.stderr.read().decode(errors="ignore").strip()
+        if self._proc.wait() != 0:
+            print(f"Streaming decode failed ({stderr[:200]}), decoding the complete upload instead")
+            self.failed = True
+
+    def kill(self) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+
+
+# ------------------ UPLOAD SESSIONS ------------------
+class UploadSession:
+    """
+    One resumable upload. Chunks are appended at byte offsets to a file in
+    `upload_dir` and streamed into the decoder at the same time; each time another
+    window of audio (`whisper_chunk_seconds`, cut at a quiet point as in chunked mode)
+    has been decoded, it is queued for transcription, so STT overlaps the upload.
+    After a dropped connection the client asks for the status and continues from
+    `received`. If finalize fails (e.g. the Whisper pool is busy) it can be called
+    again: only the failed windows are transcribed again. Only touched from the event loop.
+    """
+
+    def __init__(
+        self,
+        language: Optional[str],
+        model_size: Optional[str],
+        profile: Optional[str],
+        duration_hint: Optional[float] = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.language = language
+        self.profile = profile
+        # "auto" needs the duration before the first window is queued; without a hint assume a long recording
+        self.model_size = resolve_model_size(model_size, duration_hint or float("inf"))
+        self.path = os.path.join(settings.upload_dir, f"{self.id}.part")
+        self.received = 0
+        self.created_at = time.monotonic()
+        self.last_active = self.created_at
+        self.finalized = False
+        self._hash = hashlib.sha256()
+        self._lock = asyncio.Lock()
+        self._decoder = _StreamDecoder()
+        self._windows: List[tuple] = []
+        self._tasks: List[asyncio.Future] = []
+        self._jobs = _JobWindows()  # windows of this upload share the pool like one job
+        self._next_start = 0
+        self._pcm: Optional[np.ndarray] = None  # Complete decoded audio, set by the first finalize
+        self._result: Optional[dict] = None
+        os.makedirs(settings.upload_dir, exist_ok=True)
+        open(self.path, "wb").close()
+
+    def _write(self, chunk: bytes) -> None:
+        with open(self.path, "ab") as f:
+            f.write(chunk)
+        self._decoder.feed(chunk)
+
+    async def append(self, offset: int, chunk: bytes) -> int:
+        async with self._lock:
+            if self.finalized or self._pcm is not None:
+                raise ValueError("Upload is already finalized")
+            if offset < 0:
+                raise ValueError(f"Invalid offset: {offset}")
+            if offset > self.received:
+                raise UploadConflict(self.received)
+            # A retried chunk may overlap what already arrived: keep only the new tail
+            chunk = chunk[self.received - offset:]
+            if self.received + len(chunk) > settings.upload_max_mb * 1024 * 1024:
+                raise ValueError(f"Upload exceeds {settings.upload_max_mb} MB")
+            if chunk:
+                await asyncio.to_thread(self._write, chunk)
+                self._hash.update(chunk)
+                self.received += len(chunk)
+            self.last_active = time.monotonic()
+            self._schedule(self._decoder.samples(), final=False)
+            return self.received
+
+    def _schedule(self, pcm: np.ndarray, final: bool) -> None:
+        """Queue every window whose cut point can already be placed"""
+        loop = asyncio.get_running_loop()
+        while self._next_start < len(pcm):
+            window = next_window(
+                pcm,
+                self._next_start,
+                window_s=settings.whisper_chunk_seconds,
+                overlap_s=settings.whisper_chunk_overlap_seconds,
+                search_s=settings.whisper_chunk_silence_search_seconds,
+                final=final,
+            )
+            if window is None:
+                return
+            start, end, self._next_start = window
+            audio = pcm[start:end].astype(np.float32) / 32768.0
+            self._windows.append((start, end))
+            self._tasks.append(asyncio.ensure_future(self._transcribe_window(loop, audio)))
+
+    async def _transcribe_window(self, loop, audio: np.ndarray) -> dict:
+        executor = _get_stt_executor()
+        trimmed, remap = await _trim(loop, executor, audio)
+        if not len(trimmed):
+            return {"text": "", "segments": []}
+        result = await _transcribe_refined_window(loop, executor, self._jobs, trimmed, self.language, self.model_size, self.profile)
+        _remap_segments(result["segments"], remap)
+        return result
+
+    def _reschedule_failed(self, pcm: np.ndarray) -> None:
+        """A previous finalize failed (e.g. the pool was busy): queue the failed windows again"""
+        loop = asyncio.get_running_loop()
+        self._jobs = _JobWindows()  # a fresh admission deadline for the retry
+        for i, (start, end) in enumerate(self._windows):
+            task = self._tasks[i]
+            if task.done() and (task.cancelled() or task.exception() is not None):
+                audio = pcm[start:end].astype(np.float32) / 32768.0
+                self._tasks[i] = asyncio.ensure_future(self._transcribe_window(loop, audio))
+
+    def _restart_from(self, samples: np.ndarray) -> None:
+        """The streaming decoder failed: drop its windows and start over on the fully decoded audio"""
+        for task in self._tasks:
+            task.cancel()
+        self._windows, self._tasks, self._next_start = [], [], 0
+        self._schedule(samples, final=True)
+
+    async def finalize(self) -> dict:
+        """Wait for the remaining windows; returns {"text", "segments"} like transcribe_audio_detailed"""
+        async with self._lock:
+            if self._result is not None:
+                return self._result
+            self.finalized = True
+            self.last_active = time.monotonic()
+            if self._pcm is None:
+                await asyncio.to_thread(self._decoder.close)
+                if self._decoder.failed:
+                    data = await asyncio.to_thread(self.read_bytes)
+                    samples = await asyncio.to_thread(decode_audio_bytes, data)
+                    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+                    self._restart_from(pcm)
+                else:
+                    pcm = self._decoder.samples()
+                    self._schedule(pcm, final=True)
+                self._pcm = pcm
+                await asyncio.to_thread(self._store_pcm, pcm)  # hundreds of MB for long recordings
+            else:
+                pcm = self._pcm
+                self._reschedule_failed(pcm)
+
+            try:
+                results = await asyncio.gather(*self._tasks)
+            except WhisperPoolBusy:
+                self.finalized = False
+                raise
+            except Exception as e:
+                self.finalized = False
+                raise ValueError(f"Whisper transcription failed: {e}")
+
+            texts: List[str] = []
+            segments: List[dict] = []
+            for i, result in enumerate(results):
+                segments.extend(_owned_segments(self._windows, i, result))
+                text = result["text"].strip()
+                if texts and text:
+                    text = _stitch_pair(texts[-1], text)
+                if text:
+                    texts.append(text)
+            if not texts:
+                raise ValueError("Whisper transcription failed: Transcription resulted in empty text")
+
+            self._result = {"text": " ".join(texts), "segments": segments}
+            print(f"Upload {self.id}: {self.received / 1024 / 1024:.1f} MB, {len(pcm) / SAMPLE_RATE:.0f}s audio in {len(results)} windows")
+            return self._result
+
+    def _store_pcm(self, pcm: np.ndarray) -> None:
+        """Put the decoded audio in the PCM cache so later requests on the same file skip ffmpeg"""
+        cache = _get_pcm_cache()
+        if cache is None or not len(pcm):
+            return
+        try:
+            cache.put(self._hash.hexdigest(), pcm.astype(np.float32) / 32768.0)
+        except OSError as e:
+            print(f"Could not write PCM cache: {e}")
+
+    def read_bytes(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def samples(self) -> np.ndarray:
+        """Decoded audio of a finalized upload at 16 kHz (the float16 PCM cache mapping when cached)"""
+        cache = _get_pcm_cache()
+        cached = cache.get(self._hash.hexdigest()) if cache is not None else None
+        if cached is not None:
+            return cached
+        return decode_audio_bytes(self.read_bytes())
+
+    def status(self) -> dict:
+        done = sum(1 for task in self._tasks if task.done())
+        return {
+            "upload_id": self.id,
+            "received": self.received,
+            "decoded_seconds": round(len(self._decoder.samples()) / SAMPLE_RATE, 1),
+            "windows_queued": len(self._tasks),
+            "windows_done": done,
+            "finalized": self.finalized,
+        }
+
+    def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._decoder.kill()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+_sessions: Dict[str, UploadSession] = {}
+
+def create_upload(
+    language: Optional[str],
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+    duration_hint: Optional[float] = None,
+) -> UploadSession:
+    if not is_valid_model_size(model_size):
+        raise ValueError(f"Unknown Whisper model size: {model_size}")
+    get_decoding_options(profile)  # raises on an unknown profile
+    expire_uploads()
+    if len(_sessions) >= settings.upload_max_sessions:
+        raise OverflowError(f"Too many uploads in progress (max {settings.upload_max_sessions})")
+    session = UploadSession(language, model_size, profile, duration_hint)
+    _sessions[session.id] = session
+    return session
+
+def get_upload(upload_id: str) -> Optional[UploadSession]:
+    session = _sessions.get(upload_id)
+    if session is not None:
+        session.last_active = time.monotonic()
+    return session
+
+def close_upload(upload_id: str) -> None:
+    session = _sessions.pop(upload_id, None)
+    if session is not None:
+        session.close()
+
+def expire_uploads() -> int:
+    """Drop uploads that have been idle longer than `upload_session_ttl_seconds`"""
+    now = time.monotonic()
+    expired = [
+        upload_id for upload_id, session in _sessions.items()
+        if now - session.last_active > settings.upload_session_ttl_seconds
+    ]
+    for upload_id in expired:
+        close_upload(upload_id)
+    if expired:
+        print(f"Expired {len(expired)} idle uploads")
+    return len(expired)
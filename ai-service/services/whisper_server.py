@@ -0,0 +1,151 @@
+"""
+Local Whisper inference server.
+
+One process owns the Whisper replicas and every uvicorn worker sends it decoded
+audio over a local socket, so RAM and cold-start cost don't grow with the number
+of HTTP workers. Enable it by setting WHISPER_SERVER_ADDRESS in the API workers
+and starting the server once per host:
+
+    python -m services.whisper_server
+"""
+from typing import Optional, Tuple
+from multiprocessing.connection import Listener, Client
+import queue
+import threading
+import time
+
+from core.config import settings
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+def _authkey() -> bytes:
+    """
+    The connection unpickles whatever it receives, so the authkey is all that stands
+    between the port and code execution: there is no default, and short keys are refused.
+    """
+    key = settings.whisper_server_authkey
+    if not key or len(key) < 16:
+        raise RuntimeError(
+            "WHISPER_SERVER_AUTHKEY must be set to a secret of at least 16 characters "
+            "(shared by the Whisper server and the API workers)"
+        )
+    return key.encode("utf-8")
+
+# ------------------ CLIENT ------------------
+def remote_transcribe(
+    audio,
+    language: Optional[str],
+    model_size: Optional[str] = None,
+    profile: Optional[str] = None,
+    timeout: Optional[float] = None,
+    admitted: bool = False,
+) -> dict:
+    """Send decoded audio (16 kHz float32 array) to the inference server and wait for {"text", "segments"}"""
+    with Client(parse_address(settings.whisper_server_address), authkey=_authkey()) as conn:
+        conn.send({
+            "audio": audio,
+            "language": language,
+            "model_size": model_size,
+            "profile": profile,
+            "timeout": timeout,
+            "admitted": admitted,
+        })
+        reply = conn.recv()
+    if "error" in reply:
+        if reply.get("busy"):
+            from services.stt import WhisperPoolBusy
+            raise WhisperPoolBusy(reply["error"])
+        raise RuntimeError(reply["error"])
+    return reply["result"]
+
+# ------------------ SERVER ------------------
+class _Job:
+    def __init__(self, request: dict):
+        self.request = request
+        self.reply: Optional[dict] = None
+        self.done = threading.Event()
+
+def _inference_worker(jobs: "queue.Queue"):
+    """Each worker drains the shared job queue, so requests from all API workers share the replicas"""
+    from services.stt import WhisperPoolBusy, _transcribe_sync
+
+    while True:
+        job = jobs.get()
+        try:
+            request = job.request
+            result = _transcribe_sync(
+                request["audio"],
+                request.get("language"),
+                request.get("model_size"),
+                request.get("profile"),
+                request.get("timeout"),
+                request.get("admitted", False),
+            )
+            job.reply = {"result": result}
+        except WhisperPoolBusy as e:
+            job.reply = {"error": str(e), "busy": True}
+        except Exception as e:
+            job.reply = {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            job.done.set()
+
+def _handle_connection(conn, jobs: "queue.Queue", max_queued: int):
+    try:
+        request = conn.recv()
+        # Later windows of an admitted job are never refused: the client caps them per job
+        if jobs.qsize() >= max_queued and not request.get("admitted"):
+            conn.send({"error": f"Whisper server queue is full ({max_queued} jobs waiting)", "busy": True})
+            return
+        job = _Job(request)
+        jobs.put(job)
+        job.done.wait()
+        conn.send(job.reply)
+    except (EOFError, OSError) as e:
+        print(f"Whisper server connection dropped: {e}")
+    finally:
+        conn.close()
+
+def _idle_reaper():
+    """Unload models nobody has used for `whisper_model_idle_seconds`"""
+    from services.stt import evict_idle_models
+
+    while True:
+        time.sleep(max(1.0, settings.whisper_model_idle_seconds / 4))
+        evict_idle_models()
+
+def serve(address: Optional[str] = None):
+    from services.cpu_allocator import configure_interop_threads
+    from services.stt import _get_whisper_pool
+
+    configure_interop_threads()  # before the first model runs, or torch refuses
+
+    address = address or settings.whisper_server_address or "127.0.0.1:8765"
+    authkey = _authkey()
+    pool = _get_whisper_pool()
+    jobs: "queue.Queue" = queue.Queue()
+
+    for i in range(pool.size):
+        threading.Thread(target=_inference_worker, args=(jobs,), name=f"whisper-{i}", daemon=True).start()
+    threading.Thread(target=_idle_reaper, name="whisper-reaper", daemon=True).start()
+
+    with Listener(parse_address(address), authkey=authkey) as listener:
+        print(f"Whisper inference server listening on {address} ({pool.size} replicas per model, default {pool.model_size})")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # Bad authkey or a client that hung up during the handshake
+                print(f"Rejected Whisper server connection: {e}")
+                continue
+            threading.Thread(
+                target=_handle_connection,
+                args=(conn, jobs, pool.max_waiting + pool.size),
+                daemon=True,
+            ).start()
+
+
+if __name__ == "__main__":
+    serve()
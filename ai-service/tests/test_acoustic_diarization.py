@@ -0,0 +1,88 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("sklearn")
+
+from core.config import settings
+from services.acoustic_diarization import diarize_audio
+from services.audio import SAMPLE_RATE
+
+# (f0 in Hz, spectral tilt: how fast harmonic amplitudes fall off)
+VOICES = {
+    "low": (105.0, 1.6),
+    "mid": (175.0, 0.9),
+    "high": (260.0, 0.4),
+}
+
+
+def _voice(name: str, seconds: float, seed: int) -> np.ndarray:
+    """Harmonic series with a little vibrato, syllable-rate loudness and background noise"""
+    f0, tilt = VOICES[name]
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    phase = 2 * np.pi * np.cumsum(f0 * (1 + 0.02 * np.sin(2 * np.pi * 5 * t))) / SAMPLE_RATE
+    signal = np.zeros_like(t)
+    for k in range(1, int(4000 / f0)):
+        signal += np.sin(k * phase + rng.uniform(0, 2 * np.pi)) / k ** tilt
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t + rng.uniform(0, 2 * np.pi))
+    signal = signal * envelope / np.max(np.abs(signal))
+    return (0.5 * signal + 0.005 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def _recording(turns):
+    """Concatenate (voice, seconds) turns; returns the audio and one Whisper-style segment per turn"""
+    clips, segments, start = [], [], 0.0
+    for i, (name, seconds) in enumerate(turns):
+        clips.append(_voice(name, seconds, seed=i))
+        segments.append({"start": start, "end": start + seconds, "text": f"{name} {i}"})
+        start += seconds
+    return np.concatenate(clips), segments
+
+
+def test_segments_are_labelled_by_voice():
+    audio, segments = _recording([
+        ("low", 2.5), ("mid", 2.0), ("low", 3.0), ("high", 2.5), ("mid", 2.5), ("high", 2.0), ("low", 2.0),
+    ])
+
+    diarized = diarize_audio(audio, segments)
+
+    assert diarized == [
+        ("Speaker 1", "low 0"),
+        ("Speaker 2", "mid 1"),
+        ("Speaker 1", "low 2"),
+        ("Speaker 3", "high 3"),
+        ("Speaker 2", "mid 4"),
+        ("Speaker 3", "high 5"),
+        ("Speaker 1", "low 6"),
+    ]
+
+
+def test_consecutive_segments_of_one_voice_are_merged():
+    audio, segments = _recording([("low", 2.0), ("low", 2.0), ("high", 2.5), ("low", 2.0)])
+
+    diarized = diarize_audio(audio, segments)
+
+    assert diarized == [("Speaker 1", "low 0 low 1"), ("Speaker 2", "high 2"), ("Speaker 1", "low 3")]
+
+
+def test_short_segment_inherits_previous_speaker():
+    short = settings.acoustic_diarization_min_segment_seconds / 2
+    audio, segments = _recording([("low", 2.5), ("high", short), ("mid", 2.5), ("high", 2.5)])
+
+    diarized = diarize_audio(audio, segments)
+
+    # The short "high" segment is too short to embed and is attributed to "low", the speaker before it
+    assert diarized == [("Speaker 1", "low 0 high 1"), ("Speaker 2", "mid 2"), ("Speaker 3", "high 3")]
+
+
+def test_fixed_speaker_count():
+    audio, segments = _recording([("low", 2.0), ("mid", 2.0), ("low", 2.0), ("mid", 2.0)])
+
+    diarized = diarize_audio(audio, segments, n_speakers=2)
+
+    assert [speaker for speaker, _ in diarized] == ["Speaker 1", "Speaker 2", "Speaker 1", "Speaker 2"]
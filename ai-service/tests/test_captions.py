@@ -0,0 +1,166 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.captions import captions_text, has_speakers, parse_captions, speaker_turns
+
+SRT_LABELLED = """1
+00:00:01,000 --> 00:00:03,500
+An: Good morning everyone.
+
+2
+00:00:03,500 --> 00:00:06,000
+Binh: Morning. Let's start with the budget.
+
+3
+00:00:06,000 --> 00:00:08,250
+An: Sure, I sent the numbers yesterday.
+"""
+
+SRT_MIXED = """1
+00:00:01,000 --> 00:00:03,000
+Note: the budget is due Friday.
+
+2
+00:00:03,000 --> 00:00:05,000
+We still need a second reviewer.
+
+3
+00:00:05,000 --> 00:00:07,000
+Q: who owns the release?
+"""
+
+SRT_BRACKETS = """1
+00:00:00,000 --> 00:00:02,000
+[Chi] Let's ship it.
+
+2
+00:00:02,000 --> 00:00:04,000
+[Dung Tran] Agreed.
+"""
+
+VTT_VOICES = """WEBVTT
+
+NOTE exported by the meeting platform
+
+00:01.000 --> 00:03.000 align:start
+<v An>Hello <i>team</i>.</v>
+
+00:03.000 --> 00:05.000
+<v.loud Binh>Hi An.</v>
+
+00:05.000 --> 00:07.000
+<v An>Let's begin.</v>
+"""
+
+JSON_BAD_TIME = """{"segments": [
+    {"speaker": "An", "start": 0.0, "end": 2.5, "text": "Welcome."},
+    {"speaker": "Binh", "start": "soon", "end": 4.0, "text": "This entry has a bad time."},
+    {"speaker": "Binh", "start": "00:00:04.000", "end": "00:00:06.500", "text": "Thanks."}
+]}"""
+
+JSON_WORDS = """[
+    {"speaker_label": "spk_0", "start_time": 1, "words": [{"word": "one"}, {"text": "two"}]},
+    {"speaker_label": "spk_1", "start_time": 2, "text": ""}
+]"""
+
+
+@pytest.mark.parametrize(
+    "content, filename, expected",
+    [
+        (
+            SRT_LABELLED,
+            "meeting.srt",
+            [
+                (1.0, 3.5, "An", "Good morning everyone."),
+                (3.5, 6.0, "Binh", "Morning. Let's start with the budget."),
+                (6.0, 8.25, "An", "Sure, I sent the numbers yesterday."),
+            ],
+        ),
+        (
+            # Not every cue has a "Name:" prefix, so "Note:" and "Q:" stay in the text
+            SRT_MIXED,
+            "meeting.srt",
+            [
+                (1.0, 3.0, None, "Note: the budget is due Friday."),
+                (3.0, 5.0, None, "We still need a second reviewer."),
+                (5.0, 7.0, None, "Q: who owns the release?"),
+            ],
+        ),
+        (
+            SRT_BRACKETS,
+            None,
+            [
+                (0.0, 2.0, "Chi", "Let's ship it."),
+                (2.0, 4.0, "Dung Tran", "Agreed."),
+            ],
+        ),
+        (
+            VTT_VOICES,
+            "meeting.vtt",
+            [
+                (1.0, 3.0, "An", "Hello team."),
+                (3.0, 5.0, "Binh", "Hi An."),
+                (5.0, 7.0, "An", "Let's begin."),
+            ],
+        ),
+        (
+            # The entry with an unreadable start time is skipped, the rest of the export is kept
+            JSON_BAD_TIME,
+            "meeting.json",
+            [
+                (0.0, 2.5, "An", "Welcome."),
+                (4.0, 6.5, "Binh", "Thanks."),
+            ],
+        ),
+        (
+            JSON_WORDS,
+            None,
+            [(1.0, None, "spk_0", "one two")],
+        ),
+    ],
+)
+def test_parse_captions(content, filename, expected):
+    segments = parse_captions(content, filename)
+
+    assert [(s["start"], s["end"], s["speaker"], s["text"]) for s in segments] == expected
+
+
+@pytest.mark.parametrize(
+    "content, filename",
+    [
+        ("Just a plain transcript. Nothing structured here.", "notes.txt"),
+        ("", "empty.srt"),
+        ("{not json", "broken.json"),
+        ('{"segments": []}', "meeting.json"),
+    ],
+)
+def test_parse_captions_returns_none_for_unstructured_input(content, filename):
+    assert parse_captions(content, filename) is None
+
+
+@pytest.mark.parametrize(
+    "content, labelled",
+    [
+        (SRT_LABELLED, True),
+        (SRT_MIXED, False),
+        (VTT_VOICES, True),
+        (JSON_BAD_TIME, True),
+    ],
+)
+def test_has_speakers(content, labelled):
+    assert has_speakers(parse_captions(content)) is labelled
+
+
+def test_speaker_turns_merge_consecutive_cues():
+    segments = parse_captions(SRT_LABELLED + "\n4\n00:00:08,250 --> 00:00:09,000\nAn: Any questions?\n")
+
+    assert speaker_turns(segments) == [
+        ("An", "Good morning everyone."),
+        ("Binh", "Morning. Let's start with the budget."),
+        ("An", "Sure, I sent the numbers yesterday. Any questions?"),
+    ]
+    assert captions_text(segments).startswith("Good morning everyone. Morning.")
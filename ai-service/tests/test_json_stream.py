@@ -0,0 +1,141 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.json_stream import JsonStreamParser
+
+EXTRACTION = (
+    '{"action_items": [{"description": "Send report", "owner": "An"}, '
+    '{"description": "Hire dev", "owner": null, "priority": 2}], '
+    '"decisions": [{"text": "Ship v2"}]}'
+)
+EXTRACTION_EVENTS = [
+    (("action_items", 0), {"description": "Send report", "owner": "An"}),
+    (("action_items", 1), {"description": "Hire dev", "owner": None, "priority": 2}),
+    (("action_items",), [
+        {"description": "Send report", "owner": "An"},
+        {"description": "Hire dev", "owner": None, "priority": 2},
+    ]),
+    (("decisions", 0), {"text": "Ship v2"}),
+    (("decisions",), [{"text": "Ship v2"}]),
+]
+
+
+def _feed(parser: JsonStreamParser, pieces):
+    events = []
+    for piece in pieces:
+        events.extend(parser.feed(piece))
+    return events
+
+
+def _chunks(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize(
+    "pieces, expected, complete",
+    [
+        # The same document, whole, token-sized and one character at a time
+        ([EXTRACTION], EXTRACTION_EVENTS, True),
+        (_chunks(EXTRACTION, 5), EXTRACTION_EVENTS, True),
+        (list(EXTRACTION), EXTRACTION_EVENTS, True),
+        (
+            # Markdown fence and chatter around the root are ignored
+            ["Here you go:\n```json\n", '{"title": "Weekly', ' sync", "n": 3}', "\n```\nDone."],
+            [(("title",), "Weekly sync"), (("n",), 3)],
+            True,
+        ),
+        (
+            # Numbers and literals only complete at the following "," or bracket
+            ['{"a": 1', '2, "b": tr', 'ue, "c": nu', "ll}"],
+            [(("a",), 12), (("b",), True), (("c",), None)],
+            True,
+        ),
+        (
+            # Escaped quotes and brackets inside strings do not end the value
+            ['{"text": "He said \\"ship', ' it\\" {now} [ok]\\\\", "k": "v"}'],
+            [(("text",), 'He said "ship it" {now} [ok]\\'), (("k",), "v")],
+            True,
+        ),
+        (
+            # Truncated at max_tokens: completed items were already emitted, the rest never is
+            _chunks(EXTRACTION[:90], 7),
+            EXTRACTION_EVENTS[:1],
+            False,
+        ),
+        (
+            # Cut off inside a string
+            ['{"title": "Weekly sync", "main_content": "We talked about'],
+            [(("title",), "Weekly sync")],
+            False,
+        ),
+        (
+            # A top-level array is a root like any other: paths start with the index
+            ['[{"text": "a"}, ', '{"text": "b"}]'],
+            [((0, "text"), "a"), ((0,), {"text": "a"}), ((1, "text"), "b"), ((1,), {"text": "b"})],
+            True,
+        ),
+    ],
+)
+def test_feed_events(pieces, expected, complete):
+    parser = JsonStreamParser()
+
+    events = _feed(parser, pieces)
+
+    assert events == expected
+    assert parser.complete is complete
+
+
+def test_value_of_complete_document():
+    parser = JsonStreamParser()
+
+    _feed(parser, _chunks(EXTRACTION, 3))
+
+    assert parser.value == {
+        "action_items": [
+            {"description": "Send report", "owner": "An"},
+            {"description": "Hire dev", "owner": None, "priority": 2},
+        ],
+        "decisions": [{"text": "Ship v2"}],
+    }
+
+
+def test_truncated_document_has_no_value():
+    parser = JsonStreamParser()
+
+    _feed(parser, _chunks(EXTRACTION[:-10], 4))
+
+    assert not parser.complete
+    assert parser.value is None
+
+
+def test_only_the_first_document_of_ndjson_is_parsed():
+    parser = JsonStreamParser()
+
+    events = _feed(parser, ['{"id": 1}\n{"id"', ': 2}\n'])
+
+    assert events == [(("id",), 1)]
+    assert parser.complete
+    assert parser.value == {"id": 1}
+    assert parser.feed('{"id": 3}') == []
+
+
+@pytest.mark.parametrize(
+    "max_depth, expected",
+    [
+        (1, [(("items",), [{"a": {"b": 1}}])]),
+        (2, [(("items", 0), {"a": {"b": 1}}), (("items",), [{"a": {"b": 1}}])]),
+        (3, [
+            (("items", 0, "a"), {"b": 1}),
+            (("items", 0), {"a": {"b": 1}}),
+            (("items",), [{"a": {"b": 1}}]),
+        ]),
+    ],
+)
+def test_max_depth(max_depth, expected):
+    parser = JsonStreamParser(max_depth=max_depth)
+
+    assert _feed(parser, list('{"items": [{"a": {"b": 1}}]}')) == expected